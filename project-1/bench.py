@@ -0,0 +1,191 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from storage import TextStorage
+
+BASELINE_FILE = "bench_baseline.json"
+MARKER = "bench_data.json"  # what a generated directory holds, so it can be reused
+SLOWER = 1.2  # p50 above this multiple of the baseline is flagged
+FLUSH_LINES = 200_000  # record lines generated between writes
+
+WORDS = ["apple", "battery", "cable", "drill", "eraser", "filter", "glove", "hammer", "ink", "jacket",
+         "kettle", "lamp", "marker", "nail", "oil", "pencil", "quilt", "rope", "soap", "tape",
+         "umbrella", "valve", "wire", "yarn", "zipper"]
+
+
+def _scaled(rows, divisor, low, high):
+    return max(low, min(high, rows // divisor))
+
+
+def generate(directory, rows, seed=1):
+    """Write a catalog, opening stock and `rows` sales (plus rows/4
+    purchases) spread over up to ten years, ending yesterday"""
+    rng = random.Random(seed)
+    if os.path.exists(os.path.join(directory, MARKER)):
+        shutil.rmtree(directory)  # an older generated set
+    elif os.path.isdir(directory) and os.listdir(directory):
+        raise ValueError(f"{directory} is not empty, generate into a new directory")
+    os.makedirs(directory, exist_ok=True)
+    storage = TextStorage.in_directory(directory)
+
+    items = [f"{WORDS[i % len(WORDS)]}-{i}" for i in range(_scaled(rows, 100, 100, 50_000))]
+    prices = {name: round(rng.uniform(1, 500), 2) for name in items}
+    customers = [f"customer{i}" for i in range(_scaled(rows, 50, 50, 100_000))]
+    suppliers = [f"supplier{i}" for i in range(50)]
+    with open(storage.store.item_file, "w") as file:
+        file.writelines(f"{name},{price}\n" for name, price in prices.items())
+    with open(storage.store.inventory_file, "w") as file:
+        file.writelines(f"{name},1000000,1000000@{round(price * 0.6, 2)}\n" for name, price in prices.items())
+
+    days = _scaled(rows, 200, 30, 3650)
+    first = date.today() - timedelta(days=days)
+    sales, purchases = [], []
+    for number in range(days):
+        day = (first + timedelta(days=number)).isoformat()
+        count = rows * (number + 1) // days - rows * number // days
+        for item, customer in zip(rng.choices(items, k=count), rng.choices(customers, k=count)):
+            quantity = rng.randint(1, 5)
+            price = prices[item]
+            sales.append(f"{customer},{item},{price * quantity},{day},{round(price * 0.6 * quantity, 2)}\n")
+        for item in rng.choices(items, k=count // 4):
+            quantity = rng.randint(5, 50)
+            purchases.append(f"{rng.choice(suppliers)},{item},{quantity},{round(prices[item] * 0.6 * quantity, 2)},{day}\n")
+        if len(sales) >= FLUSH_LINES:
+            storage.sell_shards.append(sales)
+            storage.purchase_shards.append(purchases)
+            sales, purchases = [], []
+    storage.sell_shards.append(sales)
+    storage.purchase_shards.append(purchases)
+    _build_sidecars(directory)
+
+    info = {"rows": rows, "seed": seed, "first_day": first.isoformat(), "days": days}
+    with open(os.path.join(directory, MARKER), "w") as file:
+        json.dump(info, file)
+    return info
+
+
+def _build_sidecars(directory):
+    """Write the P&L rollup and date indexes of a data set, so no benchmark
+    run builds them and every run opens the set the same way"""
+    storage = TextStorage.in_directory(directory)
+    storage.rollup.update()
+    storage.rollup.flush()
+    for shards in (storage.sell_shards, storage.purchase_shards):
+        for path in shards.paths():
+            shards.index(path).update()
+
+
+def dataset(rows, directory=None, seed=1):
+    """Directory holding a generated data set of `rows` sales, made on first use"""
+    directory = directory or os.path.join(tempfile.gettempdir(), f"data-entry-bench-{rows}")
+    marker = os.path.join(directory, MARKER)
+    if os.path.exists(marker):
+        with open(marker, "r") as file:
+            info = json.load(file)
+        if info["rows"] == rows and info["seed"] == seed:
+            _build_sidecars(directory)  # sets generated before they were built
+            return directory, info
+    return directory, generate(directory, rows, seed)
+
+
+def _timed(samples, operation):
+    """Call `operation(i)` `samples` times, returns ops/s, p50 and p99 in ms"""
+    latencies = []
+    started = time.perf_counter()
+    for i in range(samples):
+        begin = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops_per_s": round(samples / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(latencies[(len(latencies) - 1) // 2] * 1000, 4),
+        "p99_ms": round(latencies[int((len(latencies) - 1) * 0.99)] * 1000, 4),
+    }
+
+
+def run(directory, info, samples=1000, seed=2):
+    """Time the core paths against a generated data set, no TTY or Tk needed.
+
+    The write benchmarks run on a scratch copy of the data set, so the
+    cached set stays as generated and every run measures the same data.
+    The set comes with its rollup and indexes, so open_and_first_pl
+    times loading them, never a rebuild.
+    """
+    rng = random.Random(seed)
+    results = {}
+
+    started = time.perf_counter()
+    storage = TextStorage.in_directory(directory)
+    items = storage.items()
+    storage.month_totals(date.today().year, date.today().month)
+    results["open_and_first_pl"] = {"ops_per_s": 0, "p50_ms": round((time.perf_counter() - started) * 1000, 4),
+                                    "p99_ms": 0}
+
+    names = rng.choices(items, k=samples)
+    first = date.fromisoformat(info["first_day"])
+    days = [first + timedelta(days=rng.randrange(info["days"])) for _ in range(samples)]
+    prefixes = [name[:2] for name in rng.choices(items, k=samples)]
+    typos = [name[:i] + "x" + name[i + 1:] for name in rng.choices(items, k=samples)
+             for i in [rng.randrange(len(name))]]
+    today = date.today()
+    writes = max(1, samples // 4)  # each write is fsynced, so fewer of them
+
+    results["stock_lookup"] = _timed(samples, lambda i: storage.quantity(names[i]))
+    results["prefix_match"] = _timed(samples, lambda i: storage.prefix_index().matches(prefixes[i], 20))
+    storage.fuzzy_index()  # built once, like the first picker of a session
+    results["fuzzy_match"] = _timed(samples, lambda i: storage.fuzzy_index().search(typos[i], 20))
+    scratch = tempfile.mkdtemp(prefix="data-entry-bench-writes-")
+    try:
+        shutil.copytree(directory, scratch, dirs_exist_ok=True)
+        copy = TextStorage.in_directory(scratch)
+        copy.items()
+        results["sell_commit"] = _timed(writes, lambda i: copy.sell("bench", names[i], 1, 1.0, today))
+        results["purchase_append"] = _timed(writes, lambda i: copy.purchase("bench", names[i], 1, 1.0, today))
+        copy.store.wait_for_compaction()
+        copy.rollup.flush()  # now, not at exit when the copy is gone
+    finally:
+        shutil.rmtree(scratch)
+    results["daily_pl"] = _timed(samples, lambda i: storage.day_totals(days[i]))
+    results["monthly_pl"] = _timed(samples, lambda i: storage.month_totals(days[i].year, days[i].month))
+    results["list_day_page"] = _timed(
+        samples, lambda i: list(islice(storage.iter_sales(days[i], days[i]), 20)))
+    results["list_latest_page"] = _timed(
+        max(1, samples // 10), lambda i: list(islice(storage.iter_sales(newest_first=True), 20)))
+    return results
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_baseline(rows, results, path=BASELINE_FILE):
+    baseline = load_baseline(path)
+    baseline[str(rows)] = results
+    with open(path, "w") as file:
+        json.dump(baseline, file, indent=1, sort_keys=True)
+
+
+def compare(results, baseline):
+    """Table rows (operation, ops/s, p50, p99, baseline p50, verdict)"""
+    rows = []
+    for operation, result in results.items():
+        before = baseline.get(operation)
+        if before is None or not before["p50_ms"]:
+            rows.append((operation, result["ops_per_s"], result["p50_ms"], result["p99_ms"], "", ""))
+            continue
+        ratio = result["p50_ms"] / before["p50_ms"]
+        verdict = "slower" if ratio > SLOWER else "faster" if ratio < 1 / SLOWER else "same"
+        rows.append((operation, result["ops_per_s"], result["p50_ms"], result["p99_ms"],
+                     before["p50_ms"], f"{verdict} ({ratio:.2f}x)"))
+    return rows
@@ -0,0 +1,221 @@
+import json
+import os
+from datetime import date
+
+from locks import atomic_write
+from records import head_crc
+from store import file_signature
+
+try:
+    import numpy as np
+except ImportError:  # analytics are optional, the rest of the app runs without numpy
+    np = None
+
+EPOCH = date(1970, 1, 1).toordinal()
+
+# Column name -> numpy dtype string, per record kind. Files are raw arrays
+# in native byte order, one value per record.
+COLUMNS = {
+    "sales": {"day": "int32", "amount": "float64", "cost": "float64", "item": "int32", "party": "int32"},
+    "purchases": {"day": "int32", "amount": "float64", "quantity": "int32",
+                  "item": "int32", "party": "int32"},
+}
+PARTY_NAMES = {"sales": "customers", "purchases": "suppliers"}
+
+
+def day_number(day):
+    """Days since 1970-01-01 for a date or an ISO date string"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal() - EPOCH
+
+
+class Dictionary:
+    """Names stored once in a text file; a name's id is its line number"""
+
+    def __init__(self, path):
+        self.path = path
+        self.names = []
+        self.ids = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    self.ids[line.rstrip("\n")] = len(self.names)
+                    self.names.append(line.rstrip("\n"))
+        self._new = []
+
+    def id(self, name):
+        found = self.ids.get(name)
+        if found is None:
+            found = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self._new.append(name)
+        return found
+
+    def save(self):
+        if self._new:
+            with open(self.path, "a") as file:
+                file.writelines(name + "\n" for name in self._new)
+            self._new = []
+
+
+class ColumnStore:
+    """Sales and purchases mirrored into memory-mapped numpy columns.
+
+    Dates are int32 day numbers, amounts float64, and items, customers and
+    suppliers are int32 ids into dictionary files. meta.json keeps, per
+    text shard, the bytes already mirrored, a checksum of the shard's head
+    and its mtime/size. `sync()` skips shards whose signature is unchanged
+    and parses only the tail of the others, so a sync with nothing new
+    opens no text file. The queries are vectorized masks, sums and
+    bincounts over whole columns, so no text is parsed.
+    """
+
+    def __init__(self, directory, sell_shards, purchase_shards):
+        if np is None:
+            raise RuntimeError("numpy is required for the columnar analytics (pip install numpy)")
+        self.directory = directory
+        self.shards = {"sales": sell_shards, "purchases": purchase_shards}
+        self.meta_file = os.path.join(directory, "meta.json")
+
+    def _path(self, kind, column):
+        return os.path.join(self.directory, kind, f"{column}.{COLUMNS[kind][column]}")
+
+    def _load_meta(self):
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file, "r") as file:
+                meta = json.load(file)
+            # sources used to hold record counts, those mirrors are rebuilt
+            if all(isinstance(source, dict) for source in meta["sources"].values()) and self._consistent(meta):
+                return meta
+        return self._reset()
+
+    def _consistent(self, meta):
+        """Every column holds exactly the row count the meta file promises"""
+        for kind, columns in COLUMNS.items():
+            rows = meta["rows"].get(kind, 0)
+            for column, dtype in columns.items():
+                path = self._path(kind, column)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                if size != rows * np.dtype(dtype).itemsize:
+                    return False
+        return True
+
+    def _reset(self):
+        for kind, columns in COLUMNS.items():
+            os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+            for column in columns:
+                open(self._path(kind, column), "wb").close()
+        for name in ["items.txt", "customers.txt", "suppliers.txt"]:
+            open(os.path.join(self.directory, name), "w").close()
+        meta = {"rows": {"sales": 0, "purchases": 0}, "sources": {}}
+        self._save_meta(meta)
+        return meta
+
+    def _save_meta(self, meta):
+        atomic_write(self.meta_file, json.dumps(meta))
+
+    def sync(self):
+        """Append records written to the text shards since the last sync"""
+        os.makedirs(self.directory, exist_ok=True)
+        meta = self._load_meta()
+        pending = {}  # kind -> list of (shard path, new records, bytes mirrored after them)
+        for kind, shards in self.shards.items():
+            for path in shards.paths():
+                sig = file_signature(path)
+                source = meta["sources"].get(path, {"offset": 0, "head": 0, "sig": None})
+                if sig is None or list(sig) == source["sig"]:
+                    continue
+                offset = source["offset"]
+                if sig[1] < offset or (offset and head_crc(path, offset) != source["head"]):
+                    # A shard lost or rewrote records, so the mirror no longer matches: start over
+                    self._reset()
+                    return self.sync()
+                records, offset = shards.tail(path, offset)
+                pending.setdefault(kind, []).append((path, records, offset, sig))
+        if not pending:
+            return meta
+
+        items = Dictionary(os.path.join(self.directory, "items.txt"))
+        for kind, sources in pending.items():
+            parties = Dictionary(os.path.join(self.directory, PARTY_NAMES[kind] + ".txt"))
+            values = {column: [] for column in COLUMNS[kind]}
+            for path, records, offset, sig in sources:
+                for record in records:
+                    values["day"].append(day_number(record.day))
+                    values["amount"].append(record.amount)
+                    values["item"].append(items.id(record.item))
+                    values["party"].append(parties.id(record.party))
+                    if "quantity" in values:
+                        values["quantity"].append(record.quantity)
+                    if "cost" in values:
+                        values["cost"].append(record.cost)
+                meta["sources"][path] = {"offset": offset, "head": head_crc(path, offset) if offset else 0,
+                                         "sig": list(sig)}
+            for column, dtype in COLUMNS[kind].items():
+                with open(self._path(kind, column), "ab") as file:
+                    np.asarray(values[column], dtype=dtype).tofile(file)
+            meta["rows"][kind] += len(values["day"])
+            parties.save()
+        items.save()
+        self._save_meta(meta)  # written last, so a crash mid-sync is caught by _consistent()
+        return meta
+
+    # ---------- queries ----------
+
+    def column(self, kind, column, rows):
+        dtype = COLUMNS[kind][column]
+        if rows == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._path(kind, column), dtype=dtype, mode="r", shape=(rows,))
+
+    def _mask(self, kind, rows, start, end):
+        days = self.column(kind, "day", rows)
+        mask = np.ones(rows, dtype=bool)
+        if start:
+            mask &= days >= day_number(start)
+        if end:
+            mask &= days <= day_number(end)
+        return mask
+
+    def profit_loss(self, start=None, end=None):
+        """(sales, purchases, cost of goods sold) between two dates, both included"""
+        meta = self.sync()
+        totals = []
+        for kind, column in (("sales", "amount"), ("purchases", "amount"), ("sales", "cost")):
+            rows = meta["rows"][kind]
+            mask = self._mask(kind, rows, start, end)
+            totals.append(float(self.column(kind, column, rows)[mask].sum()))
+        return tuple(totals)
+
+    def group_by(self, key, start=None, end=None):
+        """Per-name totals between two dates.
+
+        key "item" gives {item: (sales, purchases, cost of goods sold)};
+        "customer" gives {customer: sales}; "supplier" gives
+        {supplier: purchases}.
+        """
+        meta = self.sync()
+        if key == "item":
+            names = Dictionary(os.path.join(self.directory, "items.txt")).names
+            sums_of = [("sales", "amount"), ("purchases", "amount"), ("sales", "cost")]
+            column = "item"
+        else:
+            kind = "sales" if key == "customer" else "purchases"
+            names = Dictionary(os.path.join(self.directory, PARTY_NAMES[kind] + ".txt")).names
+            sums_of = [(kind, "amount")]
+            column = "party"
+        sums = []
+        for kind, values in sums_of:
+            rows = meta["rows"][kind]
+            mask = self._mask(kind, rows, start, end)
+            ids = self.column(kind, column, rows)[mask]
+            weights = self.column(kind, values, rows)[mask]
+            sums.append(np.bincount(ids, weights=weights, minlength=len(names)))
+        if len(sums) == 1:
+            return {name: float(total) for name, total in zip(names, sums[0]) if total}
+        return {
+            name: (float(sales), float(purchases), float(cost))
+            for name, sales, purchases, cost in zip(names, *sums)
+            if sales or purchases
+        }
@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are kept apart
+    fcntl = None
+
+
+def atomic_write(path, data, sync=False):
+    """Replace `path` with `data` (str or bytes) so readers see the old or
+    the new file, never a half-written one.
+
+    The temporary file name carries the process id, so two terminals
+    saving the same file at once don't write into each other's copy.
+    """
+    tmp_name = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_name, "wb" if isinstance(data, bytes) else "w") as file:
+        file.write(data)
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp_name, path)
+
+
+class FileLock:
+    """Advisory fcntl lock on `path`, shared by every terminal on the data
+    directory, plus a thread lock for the threads of this process.
+
+    Re-entrant: nested `with lock:` blocks take the file lock only once.
+    `with lock:` is exclusive (writers); `with lock.shared():` lets
+    several readers in at once but keeps writers out.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._mode = None
+        self._fd = None
+
+    def _flock(self, operation):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, operation)
+
+    def _acquire(self, exclusive):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                if fcntl:
+                    self._flock(fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._mode = "exclusive" if exclusive else "shared"
+        elif exclusive and self._mode == "shared":
+            self._thread_lock.release()
+            raise RuntimeError("cannot take a write lock while holding a read lock")
+        self._depth += 1
+
+    def _release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._mode = None
+            if fcntl:
+                self._flock(fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self._acquire(exclusive=True)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+    @contextmanager
+    def shared(self):
+        self._acquire(exclusive=False)
+        try:
+            yield self
+        finally:
+            self._release()
+
+
+JOURNAL_BYTES = 64 * 1024  # journal size at which a leader starts a new one
+
+
+class GroupCommit:
+    """Makes appended records durable with as few fsyncs as possible,
+    for every terminal on the data directory.
+
+    A writer appends while holding the data FileLock and, still holding
+    it, calls `mark()` with the files it wrote. That appends their paths
+    to `journal_file`, shared by all terminals, and the journal's length
+    becomes the writer's ticket. The writer then releases the data lock
+    and calls `wait()`, which queues on the sync lock (`<journal>.lock`).
+    The holder of the sync lock checks `<journal>.synced` for how much of
+    the journal is on disk already. If that covers its ticket, another
+    terminal's fsync took this write along and there is nothing to do.
+    Otherwise it becomes the leader: it fsyncs every file named in the
+    journal since the last sync once and records the new end. Writers
+    that arrive during an fsync, from any process, queue behind the
+    leader and usually find themselves covered, so under load one fsync
+    commits a whole batch. `delay` makes the leader wait that many
+    seconds first to gather a bigger batch.
+
+    The journal starts with a `#<generation>` line. Past JOURNAL_BYTES
+    the leader replaces it with an empty one of the next generation; a
+    ticket from a generation the state no longer describes is made
+    durable by fsyncing its own files.
+    """
+
+    def __init__(self, journal_file, delay=0.0):
+        self.journal_file = journal_file
+        self.state_file = journal_file + ".synced"
+        self.delay = delay
+        self.syncs = 0  # fsync rounds done by this process, for throughput measurements
+        self._lock = FileLock(journal_file + ".lock")
+        self._state_fd = None
+
+    def mark(self, *paths):
+        """Note files just appended to, returns the ticket to wait for.
+        Call it while still holding the data lock, so journal appends
+        from different terminals don't interleave."""
+        paths = tuple(os.path.abspath(path) for path in paths)
+        with open(self.journal_file, "a+b") as file:
+            if file.tell() == 0:
+                file.write(b"#0\n")
+            file.write("".join(path + "\n" for path in paths).encode())
+            file.flush()
+            end = file.tell()
+            file.seek(0)
+            generation = int(file.readline()[1:])
+        return generation, end, paths
+
+    def _state(self):
+        """(generation, bytes of its journal on disk, synced end of the
+        previous generation); only read or written under the sync lock"""
+        if self._state_fd is None:
+            self._state_fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+        os.lseek(self._state_fd, 0, os.SEEK_SET)
+        try:
+            generation, end, previous = map(int, os.read(self._state_fd, 64).split())
+        except ValueError:
+            return 0, 0, 0
+        return generation, end, previous
+
+    def _save_state(self, generation, end, previous):
+        # fixed width, so one small write always replaces the whole state
+        os.lseek(self._state_fd, 0, os.SEEK_SET)
+        os.write(self._state_fd, f"{generation:20d} {end:20d} {previous:20d}".encode())
+
+    @metrics.phased("write")
+    def wait(self, ticket):
+        """Return once the write with this ticket is on disk"""
+        generation, end, paths = ticket
+        with self._lock:
+            synced_generation, synced_end, previous_end = self._state()
+            if ((generation == synced_generation and end <= synced_end)
+                    or (generation == synced_generation - 1 and end <= previous_end)):
+                return  # a leader's fsync covered this write
+            if self.delay:
+                time.sleep(self.delay)
+            tail = None
+            if generation == synced_generation:
+                with open(self.journal_file, "rb") as file:
+                    if int(file.readline()[1:]) == generation:
+                        start = max(synced_end, file.tell())
+                        file.seek(start)
+                        tail = file.read()
+            if tail is None:
+                # the journal was replaced since this write, sync its own files
+                for path in paths:
+                    _fsync_path(path)
+                self.syncs += 1
+                return
+            tail = tail[:tail.rfind(b"\n") + 1]  # only whole lines
+            for path in set(tail.decode().splitlines()):
+                _fsync_path(path)
+            self.syncs += 1
+            new_end = start + len(tail)
+            if new_end >= JOURNAL_BYTES:
+                atomic_write(self.journal_file, f"#{generation + 1}\n")
+                self._save_state(generation + 1, 0, new_end)
+            else:
+                self._save_state(generation, new_end, previous_end)
+
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except FileNotFoundError:
+        return  # removed since it was written, e.g. a compacted ledger
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -1,94 +1,165 @@
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
+import argparse
+import csv
 import os
 import sys
-import time
-import termios
-import tkinter as tk
 from datetime import datetime, date
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import WordCompleter
 
-def select_item_gui(items):
-    """Open a GUI window to select item with autocomplete"""
-    selected_item = {"value": None}  # Use dict to allow modification inside inner function
-
-    class AutocompleteEntry(tk.Entry):
-        def __init__(self, items, *args, **kwargs):
-            super().__init__(*args, **kwargs)
-            self.items = sorted(items)
-            self.var = self["textvariable"] = tk.StringVar()
-            self.var.trace("w", self.changed)
-            self.listbox = None
-
-        def changed(self, name, index, mode):
-            if self.var.get() == "":
-                if self.listbox:
-                    self.listbox.destroy()
-                    self.listbox = None
+import metrics
+from reports import REPORTS, export_csv, report_rows, summarize
+from storage import SqliteStorage, TextStorage
+
+# tkinter, prompt_toolkit and numpy are slow to import and only needed by
+# a few screens, so they are imported inside the functions that use them.
+
+MAX_SUGGESTIONS = 20  # most names shown by the item pickers per keystroke
+DID_YOU_MEAN = 5       # close names offered when a typed item is not in the catalog
+PAGE_SIZE = 20  # rows per page in the record listings
+STARTUP_LOG = "startup_times.log"
+
+FAST_MODE = os.environ.get("DATA_ENTRY_FAST") == "1"  # no animations or screen clears
+
+
+def item_completer(index):
+    """prompt_toolkit completer backed by the catalog's PrefixIndex"""
+    from prompt_toolkit.completion import Completer, Completion
+
+    class ItemCompleter(Completer):
+        def get_completions(self, document, complete_event):
+            text = document.text_before_cursor
+            for name in index.matches(text.strip(), MAX_SUGGESTIONS):
+                yield Completion(name, start_position=-len(text))
+
+    return ItemCompleter()
+
+
+class ItemPicker:
+    """Item selection window with autocomplete.
+
+    The Tk root and its widgets are built once and hidden between sales;
+    each selection just shows the window again. Suggestions come from the
+    catalog's TrigramIndex, so misspelt or partial names still find the
+    item. Keys: type to filter, Down to move into the list, Enter to pick,
+    Escape to cancel.
+    """
+
+    def __init__(self):
+        import tkinter as tk
+
+        self.tk = tk
+        self.root = tk.Tk()
+        self.root.title("Select Item")
+        self.root.geometry("400x320")
+        self.root.protocol("WM_DELETE_WINDOW", self.cancel)  # hide, don't destroy
+
+        tk.Label(self.root, text="Type item name (Down = list, Enter = select, Esc = cancel):").pack(pady=10)
+        self.var = tk.StringVar()
+        self.entry = tk.Entry(self.root, textvariable=self.var, width=40)
+        self.entry.pack(padx=20, pady=5)
+        self.listbox = tk.Listbox(self.root, width=40, height=10)
+        self.listbox.pack(padx=20, pady=5)
+        tk.Button(self.root, text="Cancel", command=self.cancel).pack(pady=5)
+
+        self.var.trace_add("write", self.changed)
+        self.entry.bind("<Return>", self.pick_typed)
+        self.entry.bind("<Down>", self.focus_list)
+        self.entry.bind("<Escape>", self.cancel)
+        self.listbox.bind("<Return>", self.pick_selected)
+        self.listbox.bind("<ButtonRelease-1>", self.pick_selected)
+        self.listbox.bind("<Escape>", self.cancel)
+
+        self.index = None
+        self.shown = []
+        self.value = None
+        self.root.withdraw()
+
+    def choose(self, index):
+        """Show the window and wait until an item is picked (None if cancelled)"""
+        self.index = index
+        self.value = None
+        self.var.set("")
+        self.root.deiconify()
+        self.root.lift()
+        self.entry.focus_force()
+        self.root.mainloop()  # returns when finish() calls quit()
+        return self.value
+
+    def changed(self, *args):
+        text = self.var.get()
+        words = self.index.search(text, MAX_SUGGESTIONS) if text.strip() else []
+        if words != self.shown:
+            self.listbox.delete(0, self.tk.END)
+            if words:
+                self.listbox.insert(self.tk.END, *words)
+            self.shown = words
+
+    def pick_typed(self, event=None):
+        """Enter in the text box: the exact match if there is one, else the first suggestion"""
+        text = self.var.get().strip().lower()
+        for word in self.shown:
+            if word.lower() == text:
+                self.finish(word)
                 return
+        if self.shown:
+            self.finish(self.shown[0])
 
-            words = [item for item in self.items if item.lower().startswith(self.var.get().lower())]
+    def focus_list(self, event=None):
+        if self.shown:
+            self.listbox.focus_set()
+            self.listbox.selection_clear(0, self.tk.END)
+            self.listbox.selection_set(0)
+            self.listbox.activate(0)
+        return "break"
 
-            if words:
-                if not self.listbox:
-                    self.listbox = tk.Listbox()
-                    self.listbox.bind("<<ListboxSelect>>", self.on_select)
-                    self.listbox.place(x=self.winfo_x(), y=self.winfo_y() + self.winfo_height())
-                self.listbox.delete(0, tk.END)
-                for w in words:
-                    self.listbox.insert(tk.END, w)
-            else:
-                if self.listbox:
-                    self.listbox.destroy()
-                    self.listbox = None
+    def pick_selected(self, event=None):
+        selection = self.listbox.curselection()
+        if selection:
+            self.finish(self.listbox.get(selection[0]))
 
-        def on_select(self, event):
-            if self.listbox and self.listbox.curselection():
-                index = self.listbox.curselection()[0]
-                value = self.listbox.get(index)
-                selected_item["value"] = value
-                # Delay destroying root to avoid "winfo" error
-                self.after(50, root.destroy)
+    def cancel(self, event=None):
+        self.finish(None)
 
+    def finish(self, value):
+        self.value = value
+        self.root.withdraw()
+        self.root.quit()
 
-    root = tk.Tk()
-    root.title("Select Item")
-    root.geometry("400x150")
 
-    tk.Label(root, text="Type item name:").pack(pady=10)
-    entry = AutocompleteEntry(items, root)
-    entry.pack(padx=20, pady=5)
+_picker = None
 
-    # Cancel button
-    tk.Button(root, text="Cancel", command=root.destroy).pack(pady=10)
 
-    root.mainloop()
-    return selected_item["value"]
+def select_item_gui(index):
+    """Open a GUI window to select item with autocomplete"""
+    global _picker
+    with metrics.phase("ui_wait"):
+        if _picker is None:
+            _picker = ItemPicker()
+        return _picker.choose(index)
 
 
-inventory = []
 ITEM = "item_name.txt"
 FILE_NAME = "inventory.txt"
-SELL_RECORD = "sell_records.txt"
+INVENTORY_LEDGER = "inventory_ledger.txt"
+SELL_RECORD = "sell_records.txt"          # single-file layout, split on first use
 PURCHASE_RECORD = "purchase_records.txt"
+SELL_RECORDS_DIR = "sell_records"          # one YYYY-MM.csv shard per month
+PURCHASE_RECORDS_DIR = "purchase_records"
+PL_ROLLUP = "pl_rollup.json"
+REORDER_LEVELS = "reorder_levels.txt"  # name,level lines for the low-stock alerts
+DATABASE = "data_entry.db"
+COLUMNS_DIR = "columnar"  # numpy mirror of the sell/purchase records
 
-
-if os.path.exists(FILE_NAME):
-
-    with open(FILE_NAME, "r") as file:
-        
-        for line in file: 
-            parts1 = line.strip().split(",")
-            if len(parts1) < 2:
-                continue
-            name = parts1[0]        # First part is the name
-            price = float(parts1[1]) # Second part is the price (convert to number)
-            # Add to inventory
-            inventory.append({"name": name, "price": price})
+storage = TextStorage(ITEM, FILE_NAME, INVENTORY_LEDGER, SELL_RECORDS_DIR, PURCHASE_RECORDS_DIR,
+                      PL_ROLLUP, SELL_RECORD, PURCHASE_RECORD, reorder_file=REORDER_LEVELS)
 
 
 def clear_input_buffer():
     """clear any buffer keystrokes"""
     try:
+        import termios
         termios.tcflush(sys.stdin, termios.TCIFLUSH)
     except:
         try:
@@ -101,12 +172,43 @@ def clear_input_buffer():
 
 def loading_animation(message="Loading", duration=0.5):
     """Display a loading animation for given duration"""
-    for i in range(duration * 10):
-        print(f"\r{message} {'.' * (i % 4)}", end="", flush=True)
-        time.sleep(0.1)
-    os.system('cls' if os.name == 'nt' else 'clear') 
+    if FAST_MODE:
+        print(f"\n{message}")
+        return
+    with metrics.phase("animation"):
+        for i in range(duration * 10):
+            print(f"\r{message} {'.' * (i % 4)}", end="", flush=True)
+            time.sleep(0.1)
+        os.system('cls' if os.name == 'nt' else 'clear') 
+
+
+def ask(prompt=""):
+    """input() whose waiting time is counted as UI wait in the metrics"""
+    with metrics.phase("ui_wait"):
+        return input(prompt)
+
+
+def resolve_item(text):
+    """Catalog name for a typed item: the name itself in any case, or one
+    picked from the closest matches. None if nothing was picked."""
+    if not text.strip():
+        return None
+    name = storage.find(text)
+    if name is not None:
+        return name
+    matches = storage.fuzzy_index().search(text, DID_YOU_MEAN)
+    if not matches:
+        return None
+    print(f"\033[93m'{text.strip()}' is not in the catalog. Did you mean :\033[0m")
+    for number, match in enumerate(matches, 1):
+        print(f"  {number}. {match}")
+    choice = ask("Enter the number (Enter for none) : ").strip()
+    if choice.isdigit() and 1 <= int(choice) <= len(matches):
+        return matches[int(choice) - 1]
+    return None
 
     
+@metrics.timed("sell")
 def sell():
     loading_animation("\033[94mEntering Sell Module\033[0m", 1)
     clear_input_buffer()
@@ -116,59 +218,28 @@ def sell():
     print("| 0. BACK TO MENU  |")
     print("--------------------")
 
-    with open("item_name.txt", "r") as file:
-        items = [line.strip().split(",")[0] for line in file if line.strip()]
-
-    customer_name = input("\nEnter Customer Name : ")
+    customer_name = ask("\nEnter Customer Name : ")
     if customer_name == "0":
         return
 
     # Open GUI to select item
-    item_name = select_item_gui(items)
+    item_name = select_item_gui(storage.fuzzy_index())
     if item_name is None:
         return
 
-    quantity = int(input("Enter the quantity: "))
+    quantity = int(ask("Enter the quantity: "))
     if quantity == 0:
         return
 
     # ✅ Step 1: Check if item exists in ITEM file
-    item_found = False
-    item_price = 0
-    with open(ITEM, "r") as file:
-        for line in file:
-            parts = line.strip().split(",")
-            if len(parts) < 2:
-                continue
-            name = parts[0]
-            price = float(parts[1])
-            if name == item_name:
-                item_found = True
-                item_price = price
-                break
-
-    if not item_found:
+    item_price = storage.price(item_name)
+    if item_price is None:
         print("\033[91mItem does not exist in catalog! Please add it first.\033[0m")
         return
 
     # ✅ Step 2: Check if item exists in inventory and has enough quantity
-    inventory_found = False
-    inventory_qty = 0
-    with open(FILE_NAME, "r") as file:
-        lines = file.readlines()
-
-    for line in lines:
-        parts = line.strip().split(",")
-        if len(parts) < 2:
-            continue
-        name = parts[0]
-        qty = int(parts[1])
-        if name == item_name:
-            inventory_found = True
-            inventory_qty = qty
-            break
-
-    if not inventory_found:
+    inventory_qty = storage.quantity(item_name)
+    if inventory_qty is None:
         print("\033[91mItem not available in inventory! Please purchase it first.\033[0m")
         return
 
@@ -180,41 +251,95 @@ def sell():
     final_price = quantity * item_price
     print(f"\nSelling {quantity} of {item_name} to {customer_name} at total {final_price}")
 
-    # You can now update the inventory, record the sale, etc.
+    # ✅ Update the inventory and record the sale
+    current_time = datetime.now()
+    today_date = date.today()
+    if not storage.sell(customer_name, item_name, quantity, final_price, today_date):
+        print("\n\033[91mNot enough stock available! Please purchase more.\033[0m")
+        return
+    print("\033[92mInventory updated successfully ✅\033[0m")
 
-    updated_lines = []
-    for line in lines:
-        parts = line.strip().split(",")
-        if len(parts) < 2:
-            continue
-        name = parts[0]
-        qty = int(parts[1])
-        
-        if name == item_name:
-            new_qty = qty - quantity
-            updated_lines.append(f"{name},{new_qty}\n")
-        else:
-            updated_lines.append(line)
+    print(f"\033[93mSale recorded on {today_date} at {current_time.strftime('%H:%M:%S')}\033[0m")
+    warn_low_stock([item_name])
+
+
+def warn_low_stock(items):
+    """Warn about sold items that are now at or below their reorder level"""
+    for item in items:
+        level = storage.reorder_level(item)
+        if level is not None:
+            left = storage.quantity(item) or 0
+            if left <= level:
+                print(f"\033[93m⚠️  Only {left} {item} left (reorder level {level})\033[0m")
+
+@metrics.timed("cart_sell")
+def cart_sell():
+    """Sell several items to one customer and commit them together"""
+    loading_animation("\033[94mEntering Cart Sale Module\033[0m", 1)
+    clear_input_buffer()
+    print("\n------------------------------------------------")
+    print("|\t\t CART SALE                     |")
+    print("------------------------------------------------")
+    print("| 0. BACK TO MENU  |")
+    print("--------------------")
 
-    with open(FILE_NAME, "w") as file:
-        file.writelines(updated_lines)
+    customer_name = ask("\nEnter Customer Name : ")
+    if customer_name == "0":
+        return
 
-    print("\033[92mInventory updated successfully ✅\033[0m")
+    prices = storage.catalog()
+    stock = dict(storage.inventory())
+    cart = {}  # item name -> quantity, merged if an item is picked twice
+    print("\033[93mPick items one by one, close the picker window when the cart is complete.\033[0m")
 
-    for item in inventory:
-        if item['name'] == item_name:
-            item['price'] = item_price
-            item['quantity'] = inventory_qty - quantity
+    while True:
+        item_name = select_item_gui(storage.fuzzy_index())
+        if item_name is None:
             break
+        try:
+            quantity = int(ask(f"Enter the quantity of {item_name}: "))
+        except ValueError:
+            print("\033[91mInvalid quantity, line skipped!\033[0m")
+            continue
+        if quantity <= 0:
+            continue
+        if item_name not in prices:
+            print("\033[91mItem does not exist in catalog! Please add it first.\033[0m")
+            continue
+        in_cart = cart.get(item_name, 0)
+        if stock.get(item_name, 0) < in_cart + quantity:
+            print(f"\033[91mOnly {stock.get(item_name, 0) - in_cart} of {item_name} left in stock!\033[0m")
+            continue
+        cart[item_name] = in_cart + quantity
+        print(f"\033[92m+ {quantity} x {item_name}  ({len(cart)} lines in cart)\033[0m")
+
+    if not cart:
+        print("\033[91mCart is empty, nothing sold.\033[0m")
+        return
 
-    # ✅ Record the sale
-    current_time = datetime.now()
     today_date = date.today()
-    with open(SELL_RECORD, "a") as sell_file:
-        sell_file.write(f"{customer_name},{item_name},{final_price},{today_date}\n")
+    rows = [(customer_name, name, qty, qty * prices[name], today_date) for name, qty in cart.items()]
+
+    print(f"\n\t\tINVOICE - {customer_name} - {today_date}")
+    print("------------------------------------------------")
+    print("Item\tQuantity\tPrice\tAmount")
+    for _, name, qty, amount, _ in rows:
+        print(f"{name}\t{qty}\t{prices[name]}\t{amount}")
+    total = sum(amount for _, _, _, amount, _ in rows)
+    print("------------------------------------------------")
+    print(f"TOTAL\t\t\t{total}")
+
+    if ask("\nConfirm sale ? (Y/N) : ").strip().lower() != "y":
+        print("\033[91mSale cancelled.\033[0m")
+        return
+    if not storage.sell_many(rows):
+        print("\n\033[91mStock changed while billing, nothing was sold. Please try again.\033[0m")
+        return
+    print(f"\033[92mInventory updated and {len(rows)} lines recorded ✅ Invoice total {total}\033[0m")
+    warn_low_stock(dict.fromkeys(name for _, name, _, _, _ in rows))
 
-    print(f"\033[93mSale recorded on {today_date} at {current_time.strftime('%H:%M:%S')}\033[0m")
 
+@metrics.timed("purchase")
 def purchase():
     loading_animation("\033[94mEntering purchase Module\033[0m", 1) 
     clear_input_buffer()
@@ -223,38 +348,29 @@ def purchase():
     print("------------------------------------------------")
     print("| 0. BACK TO MENU  |")
     print("--------------------")
-    sup_name = input("\nEnter Supplier Name : ")
+    sup_name = ask("\nEnter Supplier Name : ")
     if sup_name == "0":
         return
-    sup_item = input("Enter Item Name :")
+    sup_item = ask("Enter Item Name :")
     if sup_item == "0":
         return
-    
-    with open(ITEM, "r") as file:
-        lines = file.readlines()
-
-        for words in lines:
-            parts3 = words.strip().split(",")
-            name = parts3[0]
-            if name == sup_item:
-                sup_quantity = int(input("Enter Item Quantity :"))
-                sup_price = float(input("Enter Item price :"))
-                final_p_price = sup_price * sup_quantity
-                current_date = datetime.today()
-                print(f"\n \t\t\t Date = {current_date}\n \t✅Purchase History Updated \n Supplyer Name = {sup_name} \n Item Name = {sup_item} \n Quantity = {sup_quantity} \n Item Price = {final_p_price} \n")
-
-                with open(PURCHASE_RECORD, "a") as purchase_file:
-                    purchase_file.write(f"{sup_name},{sup_item},{sup_quantity},{final_p_price},{current_date.date()}")
-
-                    with open(FILE_NAME, "a") as inv_file:
-                        inv_file.write(f"{sup_item},{sup_quantity},{sup_price}\n")
-                    break
+    sup_item = resolve_item(sup_item)
 
-        else :
-            print("\n\033[91mItem Dose Not Exits ! , Add Item First /033[0m")
-            print("\033[92mRedircting To Add Items Page ... \n\033[0m")
-            Add_item()
+    if sup_item is not None:
+        sup_quantity = int(ask("Enter Item Quantity :"))
+        sup_price = float(ask("Enter Item price :"))
+        final_p_price = sup_price * sup_quantity
+        current_date = datetime.today()
+        print(f"\n \t\t\t Date = {current_date}\n \t✅Purchase History Updated \n Supplyer Name = {sup_name} \n Item Name = {sup_item} \n Quantity = {sup_quantity} \n Item Price = {final_p_price} \n")
+
+        storage.purchase(sup_name, sup_item, sup_quantity, sup_price, current_date.date())
 
+    else :
+        print("\n\033[91mItem Dose Not Exits ! , Add Item First /033[0m")
+        print("\033[92mRedircting To Add Items Page ... \n\033[0m")
+        Add_item()
+
+@metrics.timed("add_item")
 def Add_item():
     loading_animation("\033[94mEntering Add Items Module\033[0m", 1) 
     clear_input_buffer()
@@ -264,30 +380,23 @@ def Add_item():
     print("| 0. BACK TO MENU   |")
     print("---------------------")
 
-    with open("item_name.txt", "r") as file:
-        items = [line.strip().split(",")[0] for line in file if line.strip()]
-
+    from prompt_toolkit import prompt
 
-    item_completer = WordCompleter(items, ignore_case=True)
+    completer = item_completer(storage.prefix_index())
 
 
-    name = prompt("\nEnter Item Name : ", completer=item_completer).strip()
+    with metrics.phase("ui_wait"):
+        name = prompt("\nEnter Item Name : ", completer=completer).strip()
     if name == "0":
         return
 
     # ✅ Check if the item already exists
-    with open(ITEM, "r") as file:
-        for line in file:
-            parts = line.strip().split(",")
-            if len(parts) < 2:
-                continue
-            existing_name = parts[0]
-            if existing_name.lower() == name.lower():
-                print(f"\n❌ \033[92mItem '{name}' already exists in the catalog!\033[0m")
-                return
+    if storage.find(name) is not None:
+        print(f"\n❌ \033[92mItem '{name}' already exists in the catalog!\033[0m")
+        return
 
     try:
-        price = float(input("Enter Item Selling Price : "))
+        price = float(ask("Enter Item Selling Price : "))
         if price <= 0:
             print("Price must be greater than 0.")
             return
@@ -296,12 +405,12 @@ def Add_item():
         return
 
     # ✅ Add the new item
-    with open(ITEM, "a") as file:
-        file.write(f"{name},{price}\n")
-    
+    storage.add_item(name, price)
+
     print(f"\033[92m\n✅ Item '{name}' added successfully with price {price}\033[0m")
 
 
+@metrics.timed("remove_item")
 def Remove_item():
         loading_animation("\033[94mEntering Remove Items Module\033[0m", 1) 
         clear_input_buffer()
@@ -310,36 +419,19 @@ def Remove_item():
         print("------------------------------------------------")
         print("| 0. BACK TO MENU  |")
         print("--------------------")
-        rem = input("\nEnter The Item Name You Want To Remove (CASE SENSITIVE !) : ")
+        rem = ask("\nEnter The Item Name You Want To Remove : ")
         if rem == "0":
             return 
-        global inventory
-        found = False
-        for item in inventory:
-            if item["name"] == rem:
-                inventory.remove(item)
-                found = True
-                break
-
-        if found:
-            sure = input(f"\033[91mARE YOU SURE YOU WANT TO DELETE THE {rem}? (Y/N) :\033[0m")
+        rem = resolve_item(rem)
+        if rem is not None and storage.quantity(rem) is not None:
+            sure = ask(f"\033[91mARE YOU SURE YOU WANT TO DELETE THE {rem}? (Y/N) :\033[0m")
             sure = sure.lower()
 
             if sure == 'y':
-
-                with open(FILE_NAME, "r") as file:
-                    lines = file.readlines()
-
-
-                    new_lines = []
-                    for line in lines:
-                        if not line.startswith(rem + ","):
-                            new_lines.append(line)
-
-                with open(FILE_NAME, "w") as remove_file:
-                    remove_file.writelines(new_lines)
-                
+                if storage.drop_item(rem):
                     print(f"\033[91m'{rem}'removed successfully.\033[0m")
+                else:
+                    print("\033[91mItem Not Found !\033[0m")  # removed from another terminal meanwhile
             else :
                 return 
         
@@ -349,6 +441,7 @@ def Remove_item():
 
 from datetime import datetime, date
 
+@metrics.timed("calculate")
 def calculate():
     loading_animation("\033[94mEntering Calculate Module\033[0m", 1) 
     clear_input_buffer()
@@ -359,56 +452,36 @@ def calculate():
     print("--------------------")
 
     try:
-        choose1 = input("Enter to find monthly or daily P & L (M/D) : ")
+        choose1 = ask("Enter to find monthly, daily or date range P & L (M/D/R) : ")
         choose1 = choose1.lower()
 
-        if choose1 not in ["m", "d"]:
-            print("\n\033[91mENTER ONLY M or D!! FOR (P & L)\033[0m")
+        if choose1 not in ["m", "d", "r"]:
+            print("\n\033[91mENTER ONLY M, D or R!! FOR (P & L)\033[0m")
             return
 
         today = date.today()
-        today_str = today.isoformat()  # "YYYY-MM-DD"
-        month = today.month
-        year = today.year
-
-        # Calculate total sales
-        total_sales = 0
-        with open(SELL_RECORD, "r") as cal_file:
-            for line in cal_file:
-                parts = line.strip().split(",")
-                amount = float(parts[2])
-                sale_date = parts[3]
-
-                if choose1 == "d":
-                    if sale_date == today_str:
-                        total_sales += amount
-                else:  # Monthly
-                    sale_date_obj = datetime.strptime(sale_date, "%Y-%m-%d").date()
-                    if sale_date_obj.year == year and sale_date_obj.month == month:
-                        total_sales += amount
-
-        # Calculate total purchases
-        total_purchases = 0
-        with open(PURCHASE_RECORD, "r") as cal_file2:
-            for line in cal_file2:
-                parts = line.strip().split(",")
-                amount = float(parts[3])
-                purchase_date = parts[4]
-
-                if choose1 == "d":
-                    if purchase_date == today_str:
-                        total_purchases += amount
-                else:
-                    purchase_date_obj = datetime.strptime(purchase_date, "%Y-%m-%d").date()
-                    if purchase_date_obj.year == year and purchase_date_obj.month == month:
-                        total_purchases += amount
-
-        result = total_sales - total_purchases
 
+        if choose1 == "d":
+            total_sales, total_purchases, cost_of_sales = storage.day_totals(today)
+        elif choose1 == "m":
+            total_sales, total_purchases, cost_of_sales = storage.month_totals(today.year, today.month)
+        else:
+            start = date.fromisoformat(ask("Enter start date (YYYY-MM-DD) : ").strip())
+            end = date.fromisoformat(ask("Enter end date (YYYY-MM-DD) : ").strip())
+            total_sales, total_purchases, cost_of_sales = storage.range_totals(start, end)
+
+        # Profit is what was sold minus what those goods cost (FIFO lots);
+        # purchases still sitting in stock are not an expense yet
+        result = total_sales - cost_of_sales
+
+        print(f"\nSales : {total_sales}")
+        print(f"Cost of Goods Sold : {cost_of_sales}")
+        print(f"Purchases : {total_purchases}")
+        period = {"d": "Daily", "m": "Monthly", "r": "Date Range"}[choose1]
         if result >= 0:
-            print(f"\n✅ Your {'Daily' if choose1 == 'd' else 'Monthly'} Profit is Around {result}")
+            print(f"\n✅ Your {period} Profit is Around {result}")
         else:
-            print(f"\n❌ Your {'Daily' if choose1 == 'd' else 'Monthly'} Loss is Around {abs(result)}")
+            print(f"\n❌ Your {period} Loss is Around {abs(result)}")
 
     except Exception as e:
         print("An error occurred:", e)
@@ -416,18 +489,18 @@ def calculate():
     
 
 
+@metrics.timed("list_items")
 def list_item():
     loading_animation("\033[94mEntering List Items Module\033[0m", 1) 
     clear_input_buffer()
     print("\n--------------------------------------------------")
     print("|\t\t ITEM LIST                       |")
     print("--------------------------------------------------")
-    with open(ITEM, "r") as list_file:
-            list_lines = list_file.readlines()
+    list_items = storage.items()
 
-    if not list_lines:  # 🟢 Check if list is EMPTY
+    if not list_items:  # 🟢 Check if list is EMPTY
         print("List IS Empty , Add Items..")
-        choose1 = input("\033[93mWant To Add New Items ?\033[93m (\033[92mY\033[0m/\033[91mN\033[0m)").lower()
+        choose1 = ask("\033[93mWant To Add New Items ?\033[93m (\033[92mY\033[0m/\033[91mN\033[0m)").lower()
         if choose1 == 'y':
             print("\n\033[92mRedirecting To Add Items ...\033[92m")
             Add_item()
@@ -437,14 +510,50 @@ def list_item():
     else:
         print("\n\t\tALL ITEM LIST 📋")
         num = 1
-        for line4 in list_lines:
-            parts4 = line4.strip().split(",")
-            if len(parts4) >= 1 and parts4[0].strip():  # 🟢 Safety check
-                l_item = parts4[0]
-                print(f"{num}) {l_item}")
-                num += 1
+        for l_item in list_items:
+            print(f"{num}) {l_item}")
+            num += 1
+
+
+def ask_record_filters(party_label):
+    """Ask how to list records, returns keyword filters for iter_sales/iter_purchases"""
+    choose = ask("Show (A)ll, (T)oday, (L)atest first or (F)ilter ? [A] : ").strip().lower()
+    if choose == "l":
+        return {"newest_first": True}
+    if choose == "t":
+        return {"start": date.today(), "end": date.today()}
+    if choose != "f":
+        return {}
+    start = ask("From date (YYYY-MM-DD, blank for any) : ").strip()
+    end = ask("To date (YYYY-MM-DD, blank for any) : ").strip()
+    party = ask(f"{party_label} (blank for any) : ").strip()
+    item = ask("Item (blank for any) : ").strip()
+    latest = ask("Latest first ? (Y/N) : ").strip().lower()
+    return {
+        "start": date.fromisoformat(start) if start else None,
+        "end": date.fromisoformat(end) if end else None,
+        party_label.lower(): party or None,
+        "item": item or None,
+        "newest_first": latest == "y",
+    }
+
+
+def show_pages(rows, header, page_size=PAGE_SIZE):
+    """Print rows a page at a time, returns how many were shown"""
+    shown = 0
+    for row in rows:
+        if shown == 0:
+            print(header)
+        elif shown % page_size == 0:
+            more = ask(f"\033[93m-- {shown} shown, Enter for more, 0 to stop --\033[0m ")
+            if more.strip() == "0":
+                break
+        print("\t".join(str(value) for value in row))
+        shown += 1
+    return shown
 
 
+@metrics.timed("list_sales")
 def list_sales():
     loading_animation("\033[94mEntering List Sales Module\033[0m", 1)
     clear_input_buffer()
@@ -453,29 +562,18 @@ def list_sales():
     print("--------------------------------------------------")
 
     try:
-        with open(SELL_RECORD, "r") as file:
-            lines = file.readlines()
-
-        if not lines:
+        filters = ask_record_filters("Customer")
+        rows = ((date_str, customer, item, amount)
+                for customer, item, amount, date_str in storage.iter_sales(**filters))
+        header = "\nDate\tCustomer\tItem\tAmount\n---------------------------------------"
+        if not show_pages(rows, header):
             print("\033[91mNo sales records found!\033[0m")
-            return
 
-        print("\nDate\tCustomer\tItem\tAmount")
-        print("---------------------------------------")
-        for line in lines:
-            parts = line.strip().split(",")
-            customer = parts[0]
-            item = parts[1]
-            amount = parts[2]
-            date_str = parts[3]
-            print(f"{date_str}\t{customer}\t{item}\t{amount}")
-
-    except FileNotFoundError:
-        print("Sales record file not found!")
     except Exception as e:
         print("An error occurred:", e)
 
 
+@metrics.timed("list_purchases")
 def list_purchases():
     loading_animation("\033[94mEntering List Purchases Module\033[0m", 1)
     clear_input_buffer()
@@ -484,30 +582,18 @@ def list_purchases():
     print("--------------------------------------------------")
 
     try:
-        with open(PURCHASE_RECORD, "r") as file:
-            lines = file.readlines()
-
-        if not lines:
+        filters = ask_record_filters("Supplier")
+        rows = ((date_str, supplier, item, quantity, amount)
+                for supplier, item, quantity, amount, date_str in storage.iter_purchases(**filters))
+        header = "\nDate\tSupplier\tItem\tQuantity\tAmount\n------------------------------------------------"
+        if not show_pages(rows, header):
             print("\033[91mNo purchase records found!\033[0m")
-            return
 
-        print("\nDate\tSupplier\tItem\tQuantity\tAmount")
-        print("------------------------------------------------")
-        for line in lines:
-            parts = line.strip().split(",")
-            supplier = parts[0]
-            item = parts[1]
-            quantity = parts[2]
-            amount = parts[3]
-            date_str = parts[4]
-            print(f"{date_str}\t{supplier}\t{item}\t{quantity}\t{amount}")
-
-    except FileNotFoundError:
-        print("Purchase record file not found!")
     except Exception as e:
         print("An error occurred:", e)
 
 
+@metrics.timed("list_inventory")
 def list_inventory():
     loading_animation("\033[94mEntering Inventory List Module\033[0m", 1)
     clear_input_buffer()
@@ -516,30 +602,107 @@ def list_inventory():
     print("--------------------------------------------------")
 
     try:
-        with open(FILE_NAME, "r") as file:
-            lines = file.readlines()
+        stock = storage.inventory()
 
-        if not lines:
+        if not stock:
             print("\033[91mInventory is empty! Please add or purchase items.\033[0m")
             return
 
-        print("\nItem Name\tQuantity")
-        print("----------------------------")
-
-        for line in lines:
-            parts = line.strip().split(",")
-            if len(parts) < 2:
-                continue
-            name = parts[0]
-            qty = int(parts[1])
-            print(f"{name}\t{qty}")
+        name_filter = ask("Item name starts with (blank for all) : ").strip().lower()
+        values = storage.valuation()
+        rows = ((name, qty, round(values.get(name, 0), 2)) for name, qty in stock
+                if name.lower().startswith(name_filter))
+        if not show_pages(rows, "\nItem Name\tQuantity\tStock Value\n--------------------------------------------"):
+            print("\033[91mNo matching items in inventory!\033[0m")
+        print(f"\nTotal stock value (at cost) : {round(sum(values.values()), 2)}")
 
-    except FileNotFoundError:
-        print("Inventory file not found! Please check the system.")
     except Exception as e:
         print(f"An error occurred: {e}")
 
-def main_fun():
+def show_low_stock():
+    """Print the items at or below their reorder level, returns how many"""
+    rows = storage.low_stock()
+    if not rows:
+        print("\033[92m✅ Nothing is below its reorder level\033[0m")
+        return 0
+    print("\nItem Name\tQuantity\tReorder Level\n--------------------------------------------")
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+    return len(rows)
+
+
+@metrics.timed("low_stock")
+def low_stock_menu():
+    loading_animation("\033[94mEntering Low Stock Module\033[0m", 1)
+    clear_input_buffer()
+    print("\n--------------------------------------------------")
+    print("|\t\t LOW STOCK / REORDER             |")
+    print("--------------------------------------------------")
+
+    try:
+        show_low_stock()
+        name = ask("\nSet a reorder level for item (blank to go back) : ").strip()
+        if not name:
+            return
+        item = resolve_item(name)
+        if item is None:
+            print("\033[91mItem does not exist in catalog!\033[0m")
+            return
+        level = ask(f"Reorder level for {item} (blank to clear) : ").strip()
+        storage.set_reorder_level(item, int(level) if level else None)
+        print(f"\033[92m✅ Reorder level for {item} {'set to ' + level if level else 'cleared'}\033[0m")
+
+    except Exception as e:
+        print("An error occurred:", e)
+
+
+@metrics.timed("reports")
+def reports_menu():
+    loading_animation("\033[94mEntering Reports Module\033[0m", 1)
+    clear_input_buffer()
+    print("\n--------------------------------------------------")
+    print("|\t\t REPORTS                         |")
+    print("--------------------------------------------------")
+    print("| 1. Top items by revenue                        |")
+    print("| 2. Top customers by revenue                    |")
+    print("| 3. Per-item margin (revenue vs cost of sales)  |")
+    print("| 4. Daily revenue                               |")
+    print("| 0. BACK TO MENU                                |")
+    print("--------------------------------------------------")
+
+    try:
+        choose = ask("Enter Your Choice : ").strip()
+        names = {"1": "top-items", "2": "top-customers", "3": "margin", "4": "daily"}
+        if choose not in names:
+            return
+        start = ask("From date (YYYY-MM-DD, blank for any) : ").strip()
+        end = ask("To date (YYYY-MM-DD, blank for any) : ").strip()
+        top = 10
+        if choose in ("1", "2"):
+            top = int(ask("How many (default 10) : ").strip() or 10)
+        export = ask("Save as CSV file (blank to only show) : ").strip()
+        show_report(names[choose], date.fromisoformat(start) if start else None,
+                    date.fromisoformat(end) if end else None, top, export or None, paged=True)
+
+    except Exception as e:
+        print("An error occurred:", e)
+
+
+def show_report(name, start, end, top=10, export=None, paged=False):
+    """Print one report and optionally save it as CSV"""
+    title, header = REPORTS[name]
+    rows = report_rows(summarize(storage, start, end), name, top)
+    print(f"\n\t\t{title} 📊")
+    page_size = PAGE_SIZE if paged else max(len(rows), 1)
+    if not show_pages(rows, "\t".join(header) + "\n" + "-" * 48, page_size):
+        print("\033[91mNo records in this period!\033[0m")
+    if export:
+        export_csv(export, header, rows)
+        print(f"\033[92m✅ Saved to {export}\033[0m")
+    return 0
+
+
+def main_fun(on_first_menu=None):
     while True:
         print("\n---------------------------------------------------")
         print("|\t\t Data Entry                       |")         
@@ -553,11 +716,17 @@ def main_fun():
         print("| 7. List all sales                               |")
         print("| 8. List all purchases                           |")
         print("| 9. List current inventory                       |")
+        print("| 11.Cart Sale (several items)                    |")
+        print("| 12.Reports                                      |")
+        print("| 13.Low stock / reorder list                     |")
         print("| 10.EXIT                                        |")
         print("---------------------------------------------------")
+        if on_first_menu:
+            on_first_menu()
+            on_first_menu = None
 
         try:
-            choose = int(input("Enter Your Choice : "))
+            choose = int(ask("Enter Your Choice : "))
             print("--------------------------------------------------")
         
             if choose == 1:
@@ -578,6 +747,12 @@ def main_fun():
                 list_purchases()
             elif choose == 9:
                 list_inventory()
+            elif choose == 11:
+                cart_sell()
+            elif choose == 12:
+                reports_menu()
+            elif choose == 13:
+                low_stock_menu()
             elif choose == 10:
                 print("\033[91mExiting The Software...\033[0m")
                 break
@@ -587,4 +762,353 @@ def main_fun():
         except ValueError:
             print("\033[91mPlease Enter a Number!\033[0m")
 
-main_fun()
+
+def migrate(db_file):
+    """Copy the text files into a new SQLite database"""
+    database = SqliteStorage(db_file)
+    if database.items() or database.inventory():
+        print(f"\033[91m{db_file} already has data, not importing again.\033[0m")
+        return 1
+    database.import_text(storage)
+    print(f"\033[92m✅ Imported text files into {db_file}\033[0m")
+    return 0
+
+
+def bulk_import(path, kind):
+    """Validate a CSV of sales or purchases and apply the good rows in one batch.
+
+    Sales:     customer,item,quantity[,date]
+    Purchases: supplier,item,quantity,unit price[,date]
+
+    Rejected rows are copied to <path>.rejected with the reason appended.
+    """
+    prices = storage.catalog()
+    stock = dict(storage.inventory())
+    today = date.today()
+    accepted = []
+    rejected = []
+
+    with open(path, "r", newline="") as file:
+        for line_no, row in enumerate(csv.reader(file), start=1):
+            if not row or not "".join(row).strip():
+                continue
+            if line_no == 1 and len(row) > 1 and row[1].strip().lower() == "item":
+                continue  # header line
+            try:
+                if kind == "sell":
+                    accepted.append(_sale_row(row, prices, stock, today))
+                else:
+                    accepted.append(_purchase_row(row, prices, stock, today))
+            except ValueError as e:
+                rejected.append((line_no, row, str(e)))
+
+    if kind == "sell":
+        if accepted and not storage.sell_many(accepted):
+            print("\033[91mStock changed during the import, nothing was recorded. Try again.\033[0m")
+            return 1
+    elif accepted:
+        storage.purchase_many(accepted)
+
+    print(f"\033[92m✅ Imported {len(accepted)} {'sales' if kind == 'sell' else 'purchases'}\033[0m")
+    if rejected:
+        with open(path + ".rejected", "w", newline="") as file:
+            writer = csv.writer(file)
+            for _, row, reason in rejected:
+                writer.writerow(row + [reason])
+        print(f"\033[91m❌ Rejected {len(rejected)} rows (saved to {path}.rejected)\033[0m")
+        for line_no, row, reason in rejected[:20]:
+            print(f"  line {line_no}: {reason}: {','.join(row)}")
+        if len(rejected) > 20:
+            print(f"  ... and {len(rejected) - 20} more")
+    return 0
+
+
+def _parse_quantity(text):
+    quantity = int(text)
+    if quantity <= 0:
+        raise ValueError("quantity must be greater than 0")
+    return quantity
+
+
+def _parse_day(row, column, today):
+    if len(row) > column and row[column].strip():
+        return date.fromisoformat(row[column].strip())
+    return today
+
+
+def _sale_row(row, prices, stock, today):
+    if len(row) < 3:
+        raise ValueError("expected customer,item,quantity[,date]")
+    customer, item = row[0].strip(), row[1].strip()
+    if item not in prices:
+        raise ValueError("item not in catalog")
+    try:
+        quantity = _parse_quantity(row[2])
+        day = _parse_day(row, 3, today)
+    except ValueError as e:
+        raise ValueError(f"bad value ({e})")
+    if stock.get(item, 0) < quantity:
+        raise ValueError("not enough stock")
+    stock[item] -= quantity
+    return (customer, item, quantity, quantity * prices[item], day)
+
+
+def _purchase_row(row, prices, stock, today):
+    if len(row) < 4:
+        raise ValueError("expected supplier,item,quantity,unit price[,date]")
+    supplier, item = row[0].strip(), row[1].strip()
+    if item not in prices:
+        raise ValueError("item not in catalog")
+    try:
+        quantity = _parse_quantity(row[2])
+        unit_price = float(row[3])
+        day = _parse_day(row, 4, today)
+    except ValueError as e:
+        raise ValueError(f"bad value ({e})")
+    if unit_price < 0:
+        raise ValueError("price must not be negative")
+    stock[item] = stock.get(item, 0) + quantity
+    return (supplier, item, quantity, unit_price, day)
+
+
+def analytics(start, end, group):
+    """Print profit/loss, optionally grouped, from the columnar mirror"""
+    if not isinstance(storage, TextStorage):
+        print("\033[91mThe columnar analytics mirror the text files, run them with --backend text.\033[0m")
+        return 1
+    from columnar import ColumnStore  # pulls in numpy, so only loaded here
+
+    try:
+        columns = ColumnStore(COLUMNS_DIR, storage.sell_shards, storage.purchase_shards)
+    except RuntimeError as e:
+        print(f"\033[91m{e}\033[0m")
+        return 1
+
+    started = time.perf_counter()
+    if group is None:
+        # Profit is sales minus the cost of the goods sold, as in calculate()
+        sales, purchases, cost_of_sales = columns.profit_loss(start, end)
+        print(f"Sales {sales}\nCost of Goods Sold {cost_of_sales}\nPurchases {purchases}\n"
+              f"Profit/Loss {sales - cost_of_sales}")
+    elif group == "item":
+        print("Item\tSales\tCost of Goods Sold\tPurchases\tProfit/Loss")
+        for name, (sales, purchases, cost_of_sales) in sorted(columns.group_by("item", start, end).items()):
+            print(f"{name}\t{sales}\t{cost_of_sales}\t{purchases}\t{sales - cost_of_sales}")
+    else:
+        print(f"{group.title()}\t{'Sales' if group == 'customer' else 'Purchases'}")
+        for name, total in sorted(columns.group_by(group, start, end).items(), key=lambda kv: -kv[1]):
+            print(f"{name}\t{total}")
+    print(f"\033[90m({(time.perf_counter() - started) * 1000:.1f} ms)\033[0m")
+    return 0
+
+
+def split_records():
+    """Split the single sell/purchase record files into monthly shards"""
+    for shards in (storage.sell_shards, storage.purchase_shards):
+        if os.path.isdir(shards.directory):
+            print(f"{shards.directory}/ already exists, nothing to split.")
+            continue
+        shards.split_legacy()
+        print(f"\033[92m✅ Split {shards.legacy_file} into {len(shards.paths())} monthly files in {shards.directory}/\033[0m")
+    return 0
+
+
+def low_stock(set_level=None):
+    """CLI: optionally set one reorder level, then list the low items"""
+    if set_level:
+        name, level = set_level
+        item = storage.find(name)
+        if item is None:
+            print(f"\033[91m{name} does not exist in the catalog\033[0m")
+            return 1
+        storage.set_reorder_level(item, None if level.lower() == "none" else int(level))
+    show_low_stock()
+    return 0
+
+
+def serve(host, port, unix_path):
+    """Keep the stores open and answer terminals until Ctrl+C"""
+    from server import serve as run_server
+
+    where = unix_path or f"{host}:{port}"
+    print(f"\033[92mServing {type(storage).__name__} on {where} (Ctrl+C to stop)\033[0m")
+    run_server(storage, host, port, unix_path)
+    return 0
+
+
+def stress(writers, sales):
+    """Race writer processes on a scratch copy of the stores and report throughput"""
+    import stress as stress_test
+
+    print(f"Running {writers} writers x {sales} sales ...")
+    result = stress_test.run(writers, sales)
+    print(f"Sold {result['sold']}, {result['stock_left']} left, "
+          f"{result['writes_per_second']:.0f} writes/s over {result['seconds']:.2f} s, "
+          f"{result['fsyncs']} fsync rounds")
+    print(f"(scratch data in {result['directory']})")
+    if not result["compacted"]:
+        print("\033[93m⚠️  The ledger was never compacted, use more sales to cover compaction\033[0m")
+    if not result["consistent"]:
+        print("\033[91m❌ Stock does not match the records!\033[0m")
+        return 1
+    if not stress_test.compaction_crash():
+        print("\033[91m❌ A compaction cut short counted stock twice!\033[0m")
+        return 1
+    print("\033[92m✅ No lost updates or oversells, and a cut-short compaction loses nothing\033[0m")
+    return 0
+
+
+def generate_data(directory, rows, seed):
+    """Write a synthetic data set for benchmarks"""
+    import bench
+
+    started = time.perf_counter()
+    try:
+        info = bench.generate(directory, rows, seed)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m")
+        return 1
+    print(f"\033[92m✅ {rows} sales over {info['days']} days written to {directory} "
+          f"in {time.perf_counter() - started:.1f} s\033[0m")
+    return 0
+
+
+def benchmark(rows, directory, samples, save):
+    """Time the core operations on a generated data set and compare with the baseline"""
+    import bench
+
+    try:
+        directory, info = bench.dataset(rows, directory)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m")
+        return 1
+    print(f"Benchmarking {rows} rows in {directory} ...")
+    results = bench.run(directory, info, samples)
+    baseline = bench.load_baseline().get(str(rows), {})
+    print("Operation\tops/s\tp50 ms\tp99 ms\tbaseline p50\tchange")
+    for row in bench.compare(results, baseline):
+        print("\t".join(str(value) for value in row))
+    if save:
+        bench.save_baseline(rows, results)
+        print(f"\033[92m✅ Saved as the baseline for {rows} rows in {bench.BASELINE_FILE}\033[0m")
+    return 0
+
+
+def report_startup(main_started):
+    """Print and log how long the imports and the first menu took"""
+    now = time.perf_counter()
+    import_ms = (IMPORT_FINISHED - IMPORT_STARTED) * 1000
+    menu_ms = (now - IMPORT_STARTED) * 1000
+    print(f"\033[90mstartup: imports {import_ms:.1f} ms, first menu {menu_ms:.1f} ms "
+          f"(main() {(now - main_started) * 1000:.1f} ms)\033[0m")
+    with open(STARTUP_LOG, "a") as log:
+        log.write(f"{datetime.now().isoformat(timespec='seconds')},{import_ms:.1f},{menu_ms:.1f}\n")
+
+
+def main(argv=None):
+    main_started = time.perf_counter()
+    parser = argparse.ArgumentParser(description="Inventory data entry")
+    parser.add_argument("--backend", choices=["text", "sqlite"],
+                        default=os.environ.get("DATA_ENTRY_BACKEND", "text"),
+                        help="where data is stored (default: text files)")
+    parser.add_argument("--db", default=DATABASE, help="SQLite database file")
+    parser.add_argument("--fast", action="store_true",
+                        help="operator mode: no loading animations or screen clears")
+    parser.add_argument("--server", default=os.environ.get("DATA_ENTRY_SERVER"),
+                        help="use a running `serve` process (host:port or Unix socket path) instead of the files")
+    parser.add_argument("--workers", type=int,
+                        help="processes for full-history totals and reports (default: one per CPU)")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                        help="run each menu action or command under cProfile, stats saved in DIR (default: profiles)")
+    parser.add_argument("--startup-report", action="store_true",
+                        help=f"print import and first-menu time and append them to {STARTUP_LOG}")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("migrate", help="import the text files into the SQLite database")
+    commands.add_parser("split-records", help="split sell/purchase record files into monthly shards")
+    import_parser = commands.add_parser("import", help="bulk load sales or purchases from a CSV file")
+    import_parser.add_argument("file", help="CSV file to import")
+    import_parser.add_argument("--kind", choices=["sell", "purchase"], required=True)
+    analytics_parser = commands.add_parser("analytics", help="profit/loss from the columnar mirror (needs numpy)")
+    analytics_parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first date (YYYY-MM-DD)")
+    analytics_parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last date (YYYY-MM-DD)")
+    analytics_parser.add_argument("--by", choices=["item", "customer", "supplier"], help="group the totals")
+    report_parser = commands.add_parser("report", help="sales reports, optionally saved as CSV")
+    report_parser.add_argument("name", choices=sorted(REPORTS))
+    report_parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first date (YYYY-MM-DD)")
+    report_parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last date (YYYY-MM-DD)")
+    report_parser.add_argument("--top", type=int, default=10, help="rows in the top-N reports")
+    report_parser.add_argument("--csv", help="also write the report to this CSV file")
+    serve_parser = commands.add_parser("serve", help="headless transaction server for terminals (JSON lines)")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    generate_parser = commands.add_parser("generate", help="write a synthetic data set for benchmarks")
+    generate_parser.add_argument("directory", help="new directory to fill")
+    generate_parser.add_argument("--rows", type=int, default=100_000, help="sales to generate (purchases: a quarter)")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    bench_parser = commands.add_parser("bench", help="time core operations on synthetic data")
+    bench_parser.add_argument("--rows", type=int, default=100_000, help="size of the data set")
+    bench_parser.add_argument("--dir", help="data set directory (default: a cached one in the temp dir)")
+    bench_parser.add_argument("--samples", type=int, default=1000, help="calls timed per operation")
+    bench_parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    low_parser = commands.add_parser("low-stock", help="items at or below their reorder level")
+    low_parser.add_argument("--set", nargs=2, metavar=("ITEM", "LEVEL"),
+                            help="set an item's reorder level first (LEVEL 'none' clears it)")
+    stress_parser = commands.add_parser("stress", help="check concurrent writers on scratch data and time them")
+    stress_parser.add_argument("--writers", type=int, default=4, help="writer processes")
+    stress_parser.add_argument("--sales", type=int, default=500, help="sales per writer")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        metrics.profile_dir = args.profile
+    if args.command is None:
+        return run(args, main_started)  # menu actions are profiled one by one
+    with metrics.profiled(args.command):
+        return run(args, main_started)
+
+
+def run(args, main_started):
+    """Carry out the parsed command line"""
+    global storage, FAST_MODE
+    if args.command == "migrate":
+        return migrate(args.db)
+    if args.command == "split-records":
+        return split_records()
+    if args.command == "stress":
+        return stress(args.writers, args.sales)
+    if args.command == "generate":
+        return generate_data(args.directory, args.rows, args.seed)
+    if args.command == "bench":
+        return benchmark(args.rows, args.dir, args.samples, args.save_baseline)
+
+    if args.backend == "sqlite":
+        storage = SqliteStorage(args.db)
+    elif args.workers:
+        storage.workers = storage.rollup.workers = args.workers
+
+    if args.command == "serve":
+        return serve(args.host, args.port, args.unix)
+    if args.server:
+        from server import RemoteStorage
+        storage = RemoteStorage(args.server)
+
+    if args.fast:
+        FAST_MODE = True
+
+    if args.command == "import":
+        return bulk_import(args.file, args.kind)
+    if args.command == "analytics":
+        return analytics(args.start, args.end, args.by)
+    if args.command == "low-stock":
+        return low_stock(args.set)
+    if args.command == "report":
+        return show_report(args.name, args.start, args.end, args.top, args.csv)
+    main_fun(on_first_menu=(lambda: report_startup(main_started)) if args.startup_report else None)
+    return 0
+
+
+IMPORT_FINISHED = time.perf_counter()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
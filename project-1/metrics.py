@@ -0,0 +1,154 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+METRICS_FILE = "metrics.log"
+MAX_BYTES = 1024 * 1024  # metrics file size before it is rotated
+BACKUPS = 5              # rotated files kept: metrics.log.1 .. metrics.log.5
+PHASES = ["read", "parse", "validate", "write", "ui_wait", "animation"]
+# Each metrics line: time,action,total_ms,read_ms,parse_ms,validate_ms,
+# write_ms,ui_wait_ms,animation_ms,other_ms
+
+enabled = os.environ.get("DATA_ENTRY_METRICS", "1") != "0"
+profile_dir = None  # set by --profile: every timed action also runs under cProfile
+
+_local = threading.local()
+_profiles = itertools.count(1)  # numbers profiles saved in the same microsecond apart
+_logger = None
+
+
+class Operation:
+    """Wall time of one action split into phases.
+
+    Phases nest; time is charged to the innermost open phase only, so a
+    storage reload inside a write counts as "read", not twice. Whatever
+    is not inside a phase ends up as "other".
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.stack = []
+        self.started = time.perf_counter()
+        self.mark = self.started
+
+    def _charge(self, now):
+        if self.stack:
+            self.times[self.stack[-1]] = self.times.get(self.stack[-1], 0.0) + now - self.mark
+        self.mark = now
+
+    @contextmanager
+    def phase(self, name):
+        self._charge(time.perf_counter())
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            self.stack.pop()
+
+    def line(self):
+        total = time.perf_counter() - self.started
+        other = total - sum(self.times.values())
+        values = [self.times[name] for name in PHASES] + [other]
+        return ",".join([datetime.now().isoformat(timespec="seconds"), self.action, f"{total * 1000:.2f}"]
+                        + [f"{value * 1000:.2f}" for value in values])
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+def phase(name):
+    """Context manager charging the time inside it to `name` in the
+    current action, or doing nothing outside a timed action"""
+    operation = getattr(_local, "operation", None)
+    if operation is None:
+        return _nothing()
+    return operation.phase(name)
+
+
+def _log(line):
+    global _logger
+    if _logger is None:
+        import logging
+        from logging.handlers import RotatingFileHandler  # only paid for once metrics are written
+
+        handler = RotatingFileHandler(METRICS_FILE, maxBytes=MAX_BYTES, backupCount=BACKUPS)
+        _logger = logging.getLogger("data_entry.metrics")
+        _logger.propagate = False
+        _logger.setLevel(logging.INFO)
+        _logger.addHandler(handler)
+    _logger.info(line)
+
+
+@contextmanager
+def profiled(action):
+    """Run the block under cProfile when --profile is on, saving the stats
+    to <profile_dir>/<action>-<time>-<n>.prof (open with pstats or snakeviz)"""
+    if profile_dir is None or getattr(_local, "profiling", False):
+        yield  # one profiler at a time, the outer one covers this block
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    _local.profiling = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.profiling = False
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, f"{action}-{datetime.now():%Y%m%d-%H%M%S-%f}-{next(_profiles)}.prof")
+        profiler.dump_stats(path)
+        print(f"\033[90mprofile saved to {path}\033[0m")
+
+
+@contextmanager
+def measure(action):
+    """Time one action and append its phases to the metrics file"""
+    if getattr(_local, "operation", None) is not None:
+        yield  # part of an action that is already being timed
+        return
+    if not enabled:
+        with profiled(action):
+            yield
+        return
+    _local.operation = Operation(action)
+    try:
+        with profiled(action):
+            yield
+    finally:
+        operation, _local.operation = _local.operation, None
+        _log(operation.line())
+
+
+def phased(name):
+    """Decorator charging every call of a function to phase `name`"""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            operation = getattr(_local, "operation", None)
+            if operation is None:
+                return function(*args, **kwargs)
+            with operation.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed(action):
+    """Decorator form of measure()"""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with measure(action):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,112 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_BYTES = 8 * 1024 * 1024          # size of the byte ranges handed to workers
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024  # below this, starting processes costs more than it saves
+
+
+class Partial:
+    """Sums by day, item and customer/supplier for one record kind, plus
+    the cost of goods sold by day and by item for sales"""
+
+    def __init__(self):
+        self.daily = {}
+        self.items = {}
+        self.parties = {}
+        self.daily_cost = {}
+        self.item_cost = {}
+
+    def merge(self, other):
+        for mine, theirs in ((self.daily, other.daily), (self.items, other.items),
+                             (self.parties, other.parties), (self.daily_cost, other.daily_cost),
+                             (self.item_cost, other.item_cost)):
+            for key, amount in theirs.items():
+                mine[key] = mine.get(key, 0) + amount
+
+
+def chunk_ranges(path, chunk_bytes=CHUNK_BYTES):
+    """Split a file into (start, end) byte ranges that end just after a newline"""
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as file:
+        while start < size:
+            end = start + chunk_bytes
+            if end < size:
+                file.seek(end)
+                file.readline()  # run on to the end of the line we landed in
+                end = file.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _aggregate_chunk(task):
+    """Worker: parse one byte range and return (Partial, bytes of complete lines)"""
+    path, start, end, record_type, first_day, last_day = task
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    lines = data.split(b"\n")
+    covered = start + len(data) - len(lines[-1])  # a half-written last line is left out
+    partial = Partial()
+    daily, items, parties, daily_cost = partial.daily, partial.items, partial.parties, partial.daily_cost
+    item_cost = partial.item_cost
+    parse = record_type.parse
+    costed = "cost" in record_type.__slots__
+    for raw in lines[:-1]:
+        record = parse(raw.decode(errors="replace"))
+        if record is None:
+            continue
+        day = record.day
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        amount = record.amount
+        daily[day] = daily.get(day, 0) + amount
+        items[record.item] = items.get(record.item, 0) + amount
+        parties[record.party] = parties.get(record.party, 0) + amount
+        if costed and record.cost:
+            daily_cost[day] = daily_cost.get(day, 0) + record.cost
+            item_cost[record.item] = item_cost.get(record.item, 0) + record.cost
+    return partial, covered
+
+
+def aggregate(sources, start=None, end=None, workers=None):
+    """Sum records of several files by day, item and party, in parallel.
+
+    `sources` is a list of (kind, path, record_type). Returns
+    ({kind: Partial}, {path: bytes covered}).
+
+    Files are cut into fixed CHUNK_BYTES ranges whatever the worker count,
+    and partial sums are merged in file order, so the floating point
+    totals are identical to a serial run (workers=1).
+    """
+    first_day = start.isoformat() if start else None
+    last_day = end.isoformat() if end else None
+    tasks = []
+    kinds = []
+    total_bytes = 0
+    for kind, path, record_type in sources:
+        if not os.path.exists(path):
+            continue
+        total_bytes += os.path.getsize(path)
+        for chunk_start, chunk_end in chunk_ranges(path):
+            tasks.append((path, chunk_start, chunk_end, record_type, first_day, last_day))
+            kinds.append(kind)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1 and total_bytes >= PARALLEL_MIN_BYTES:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(_aggregate_chunk, tasks))
+    else:
+        results = [_aggregate_chunk(task) for task in tasks]
+
+    totals = {kind: Partial() for kind, _, _ in sources}
+    covered = {}
+    for kind, task, (partial, chunk_covered) in zip(kinds, tasks, results):
+        totals[kind].merge(partial)
+        covered[task[0]] = chunk_covered
+    return totals, covered
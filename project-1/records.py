@@ -0,0 +1,655 @@
+import atexit
+import json
+import mmap
+import os
+import re
+import shutil
+import zlib
+from bisect import bisect_left, bisect_right
+from contextlib import nullcontext
+from datetime import date, timedelta
+
+import metrics
+from locks import atomic_write
+from store import file_signature
+
+# Column layout of the record files
+SELL_AMOUNT, SELL_DATE = 2, 3          # customer,item,amount,date[,cost]
+SELL_COST = 4                          # FIFO cost of the goods sold, absent on old records
+PURCHASE_AMOUNT, PURCHASE_DATE = 3, 4  # supplier,item,quantity,amount,date
+
+HEAD_BYTES = 64  # leading bytes remembered to notice a rewritten file
+CACHED_SHARDS = 24  # monthly shards kept parsed in memory
+SAVE_BYTES = 1024 * 1024  # record bytes added to the rollup before it is saved again
+BLOCK_SIZE = 64 * 1024  # bytes read per step when reading a file backwards
+# A date run straight into the next record, as the old purchase() wrote them
+RUN_ON = re.compile(r"(\d{4}-\d{2}-\d{2})(?=[^,\n])")
+
+
+def read_lines(path, start=0, end=None):
+    """Yield (offset, line) for each complete line between byte offsets
+    `start` and `end`, through mmap"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            position = start
+            while position < end:
+                newline = mm.find(b"\n", position, end)
+                if newline == -1:
+                    return  # half-written record, pick it up next time
+                yield position, mm[position:newline].decode(errors="replace")
+                position = newline + 1
+
+
+def read_lines_backwards(path, start=0, end=None, block_size=BLOCK_SIZE):
+    """Yield the complete lines between byte offsets `start` and `end` from
+    last to first, reading one block at a time"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        position = size if end is None else min(end, size)
+        carry = None  # start of a line whose beginning is in an earlier block
+        while position > start:
+            step = min(block_size, position - start)
+            position -= step
+            file.seek(position)
+            lines = file.read(step).split(b"\n")
+            if carry is None:
+                lines[-1] = b""  # half-written record, or nothing after the last newline
+            else:
+                lines[-1] += carry
+            carry = lines.pop(0)
+            for raw in reversed(lines):
+                if raw:
+                    yield raw.decode(errors="replace")
+        if carry:
+            yield carry.decode(errors="replace")
+
+
+class Sale:
+    """One line of a sell record file: customer,item,amount,date[,cost]"""
+
+    __slots__ = ("customer", "item", "amount", "day", "cost")
+
+    def __init__(self, customer, item, amount, day, cost=0.0):
+        self.customer = customer
+        self.item = item
+        self.amount = amount  # float
+        self.day = day        # "YYYY-MM-DD"
+        self.cost = cost      # float, FIFO cost of the goods sold (0 if not recorded)
+
+    @property
+    def party(self):
+        return self.customer
+
+    def __iter__(self):
+        return iter((self.customer, self.item, self.amount, self.day))
+
+    @classmethod
+    def parse(cls, line):
+        """Sale from a record line, or None if the line is malformed"""
+        parts = line.strip().split(",")
+        if len(parts) < 4:
+            return None
+        try:
+            return cls(parts[0], parts[1], float(parts[2]), date.fromisoformat(parts[3]).isoformat(),
+                       float(parts[SELL_COST]) if len(parts) > SELL_COST else 0.0)
+        except ValueError:
+            return None
+
+
+class Purchase:
+    """One line of a purchase record file: supplier,item,quantity,amount,date"""
+
+    __slots__ = ("supplier", "item", "quantity", "amount", "day")
+
+    def __init__(self, supplier, item, quantity, amount, day):
+        self.supplier = supplier
+        self.item = item
+        self.quantity = quantity  # int
+        self.amount = amount      # float, quantity * unit price
+        self.day = day            # "YYYY-MM-DD"
+
+    @property
+    def party(self):
+        return self.supplier
+
+    def __iter__(self):
+        return iter((self.supplier, self.item, self.quantity, self.amount, self.day))
+
+    @classmethod
+    def parse(cls, line):
+        """Purchase from a record line, or None if the line is malformed"""
+        parts = line.strip().split(",")
+        if len(parts) < 5:
+            return None
+        try:
+            return cls(parts[0], parts[1], int(parts[2]), float(parts[3]),
+                       date.fromisoformat(parts[4]).isoformat())
+        except ValueError:
+            return None
+
+
+class ParsedRecords:
+    """Typed records of one record file, parsed once and kept in memory.
+
+    `refresh()` is a no-op while the file's mtime/size are unchanged. When
+    the file only grew it parses just the new tail, and it starts over if
+    the file shrank or its head changed.
+    """
+
+    def __init__(self, path, record_type):
+        self.path = path
+        self.record_type = record_type
+        self._reset()
+
+    def _reset(self):
+        self.records = []  # Sale/Purchase objects in file order
+        self.offsets = []  # byte offset of each record's line
+        self.length = 0    # bytes parsed so far
+        self.head = 0
+        self.sig = None
+
+    @metrics.phased("parse")
+    def refresh(self):
+        sig = file_signature(self.path)
+        if sig == self.sig:
+            return
+        size = sig[1] if sig else 0
+        if size < self.length or (self.length and head_crc(self.path, self.length) != self.head):
+            self._reset()
+        if sig is not None:
+            parse = self.record_type.parse
+            for offset, line in read_lines(self.path, self.length):
+                record = parse(line)
+                if record is not None:
+                    self.records.append(record)
+                    self.offsets.append(offset)
+                self.length = offset + len(line.encode()) + 1
+            self.head = head_crc(self.path, self.length)
+        self.sig = sig
+
+
+def head_crc(path, length):
+    with open(path, "rb") as file:
+        return zlib.crc32(file.read(min(length, HEAD_BYTES)))
+
+
+class DateIndex:
+    """Sidecar `<record file>.idx` mapping each date to the byte offset of
+    its first record.
+
+    Records are appended in date order, so the dates in the file form
+    sorted runs. `span()` bisects the index for the byte range holding a
+    date range, and readers go straight there instead of parsing from
+    the start of the file. The index follows appends by only reading the
+    new tail, and is rebuilt if the file shrank or its head changed. If a
+    record ever arrives out of date order the index marks itself
+    unordered and `span()` falls back to the whole file.
+    """
+
+    def __init__(self, path, date_col):
+        self.path = path
+        self.date_col = date_col
+        self.index_file = path + ".idx"
+        self._reset()
+        self._loaded = False
+
+    def _reset(self):
+        self.days = []     # date of each run, in file order
+        self.offsets = []  # byte offset where each run starts
+        self.length = 0    # bytes of the record file covered by the index
+        self.head = 0      # crc32 of the first bytes, to notice a rewrite
+        self.ordered = True
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as file:
+                length, ordered, head = file.readline().strip().split(",")
+                for line in file:
+                    day, offset = line.strip().split(",")
+                    self.days.append(day)
+                    self.offsets.append(int(offset))
+            self.length, self.ordered, self.head = int(length), ordered == "1", int(head)
+        except ValueError:
+            self._reset()
+
+    def save(self):
+        atomic_write(self.index_file, f"{self.length},{int(self.ordered)},{self.head}\n"
+                     + "".join(f"{day},{offset}\n" for day, offset in zip(self.days, self.offsets)))
+
+    @metrics.phased("parse")
+    def update(self):
+        """Index whatever was appended since the last update"""
+        if not self._loaded:
+            self._load()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < self.length or (self.length and head_crc(self.path, self.length) != self.head):
+            self._reset()
+        if size == self.length:
+            return
+        position = self.length
+        with open(self.path, "rb") as file:
+            file.seek(position)
+            for raw in file:
+                if not raw.endswith(b"\n"):
+                    break  # half-written record, pick it up next time
+                parts = raw.split(b",")
+                day = parts[self.date_col].strip().decode(errors="replace") if len(parts) > self.date_col else ""
+                if not self.days or day != self.days[-1]:
+                    if self.days and day < self.days[-1]:
+                        self.ordered = False
+                    self.days.append(day)
+                    self.offsets.append(position)
+                position += len(raw)
+        self.length = position
+        self.head = head_crc(self.path, self.length)
+        self.save()
+
+    def span(self, start=None, end=None):
+        """(first, last) byte offsets holding the records dated [start, end].
+
+        `last` is None for "to the end of the file".
+        """
+        self.update()
+        if not self.ordered:
+            return 0, None
+        first, last = 0, None
+        if start:
+            i = bisect_left(self.days, start.isoformat())
+            first = self.offsets[i] if i < len(self.days) else self.length
+        if end:
+            i = bisect_right(self.days, end.isoformat())
+            last = self.offsets[i] if i < len(self.days) else None
+        return first, last
+
+
+UNDATED = "undated"  # shard for records whose date does not parse
+
+
+def _manifest_json(manifest):
+    return json.dumps({"shards": dict(sorted(manifest.items()))}, indent=1)
+
+
+class RecordShards:
+    """Sell or purchase records split into one file per month.
+
+    `directory` holds `YYYY-MM.csv` shards and a `manifest.json` listing
+    them with their record counts. Writers append each record to the
+    shard of its month, and readers only open the shards that overlap
+    the dates they need. If the directory does not exist yet, the old
+    single `legacy_file` is split into it on first use and kept as
+    `<legacy_file>.bak`. The split holds `lock`, the writers' FileLock,
+    and builds the shards under a temporary name, so other terminals see
+    either no directory or a finished one with its manifest.
+    """
+
+    def __init__(self, directory, date_col, record_type, legacy_file=None, lock=None):
+        self.directory = directory
+        self.date_col = date_col
+        self.record_type = record_type
+        self.legacy_file = legacy_file
+        self.lock = lock
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self.manifest = {}  # month -> {"file": name, "records": count}
+        self._manifest_sig = False
+        self._indexes = {}  # shard path -> DateIndex
+        self._parsed = {}   # shard path -> ParsedRecords, least recently used first
+        self._listed = set()  # shards listed once; listing one again caches it
+
+    def _month_of(self, day):
+        try:
+            return date.fromisoformat(day.strip()).isoformat()[:7]
+        except ValueError:
+            return UNDATED
+
+    def _refresh(self):
+        if not os.path.isdir(self.directory):
+            self.split_legacy()
+        sig = file_signature(self.manifest_file)
+        if sig != self._manifest_sig:
+            self.manifest = {}
+            if sig is not None:
+                with open(self.manifest_file, "r") as file:
+                    self.manifest = json.load(file)["shards"]
+            self._manifest_sig = sig
+
+    def _save_manifest(self):
+        atomic_write(self.manifest_file, _manifest_json(self.manifest))
+        self._manifest_sig = file_signature(self.manifest_file)
+
+    def split_legacy(self):
+        """One-time split of the single legacy record file into monthly shards"""
+        with self.lock or nullcontext():
+            if os.path.isdir(self.directory):
+                return  # another terminal split it while we waited for the lock
+            building = f"{self.directory}.{os.getpid()}.tmp"
+            shutil.rmtree(building, ignore_errors=True)
+            os.makedirs(building)
+            manifest = {}
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                by_month = {}
+                with open(self.legacy_file, "r") as file:
+                    for line in file:
+                        # Old purchase files have no newlines between records, so
+                        # break them up after each date
+                        for record in RUN_ON.sub("\\1\n", line.strip()).split("\n"):
+                            if not record:
+                                continue
+                            parts = record.split(",")
+                            day = parts[self.date_col] if len(parts) > self.date_col else ""
+                            by_month.setdefault(self._month_of(day), []).append(record + "\n")
+                for month, lines in by_month.items():
+                    # Stable sort by date so each shard starts out in date order
+                    lines.sort(key=lambda line: line.split(",")[self.date_col] if line.count(",") >= self.date_col else "")
+                    manifest[month] = {"file": f"{month}.csv", "records": len(lines)}
+                    with open(os.path.join(building, manifest[month]["file"]), "w") as file:
+                        file.write("".join(lines))
+            atomic_write(os.path.join(building, "manifest.json"), _manifest_json(manifest))
+            os.rename(building, self.directory)
+            if self.legacy_file and os.path.exists(self.legacy_file):
+                os.replace(self.legacy_file, self.legacy_file + ".bak")
+            self._manifest_sig = False  # read the new manifest on the next _refresh()
+
+    def _write_shard(self, month, lines):
+        entry = self.manifest.setdefault(month, {"file": f"{month}.csv", "records": 0})
+        with open(os.path.join(self.directory, entry["file"]), "a") as file:
+            file.write("".join(lines))
+        entry["records"] += len(lines)
+
+    @metrics.phased("write")
+    def append(self, lines):
+        """Append record lines, each one going to the shard of its own month.
+        Returns the shard files written to."""
+        self._refresh()
+        by_month = {}
+        for line in lines:
+            parts = line.split(",")
+            day = parts[self.date_col] if len(parts) > self.date_col else ""
+            by_month.setdefault(self._month_of(day), []).append(line)
+        paths = []
+        for month, month_lines in by_month.items():
+            self._write_shard(month, month_lines)
+            paths.append(os.path.join(self.directory, self.manifest[month]["file"]))
+            self.index(paths[-1]).update()
+        self._save_manifest()
+        return paths
+
+    def index(self, path):
+        """DateIndex of one shard"""
+        if path not in self._indexes:
+            self._indexes[path] = DateIndex(path, self.date_col)
+        return self._indexes[path]
+
+    def paths(self, start=None, end=None):
+        """Shard files overlapping [start, end] in month order (None = open ended)"""
+        self._refresh()
+        first = start.isoformat()[:7] if start else None
+        last = end.isoformat()[:7] if end else None
+        found = []
+        for month in sorted(self.manifest):
+            if month == UNDATED:
+                if first is None and last is None:
+                    found.append(month)
+                continue
+            if first and month < first:
+                continue
+            if last and month > last:
+                continue
+            found.append(month)
+        return [os.path.join(self.directory, self.manifest[month]["file"]) for month in found]
+
+
+    def records(self, start=None, end=None, newest_first=False):
+        """Typed records that may fall in [start, end].
+
+        The first listing of a shard streams it from the span its date
+        index gives, backwards for latest-first listings, so a listing
+        that stops after one page only reads that page. A shard listed
+        again is parsed into the cache, and later listings slice the
+        cached records with the same span.
+        """
+        parse = self.record_type.parse
+        paths = self.paths(start, end)
+        if newest_first:
+            paths.reverse()
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            first, last = self.index(path).span(start, end)
+            if path in self._parsed or path in self._listed:
+                parsed = self.parsed(path)
+                parsed.refresh()
+                lo = bisect_left(parsed.offsets, first)
+                hi = len(parsed.offsets) if last is None else bisect_left(parsed.offsets, last)
+                if newest_first:
+                    for i in range(hi - 1, lo - 1, -1):
+                        yield parsed.records[i]
+                else:
+                    for i in range(lo, hi):
+                        yield parsed.records[i]
+                continue
+            self._listed.add(path)
+            if newest_first:
+                lines = read_lines_backwards(path, first, last)
+            else:
+                lines = (line for _, line in read_lines(path, first, last))
+            for line in lines:
+                record = parse(line)
+                if record is not None:
+                    yield record
+
+    @metrics.phased("parse")
+    def tail(self, path, offset=0):
+        """(records, end offset) of one shard from byte `offset` on.
+
+        Parsed straight from the file, not cached: the P&L rollup and the
+        columnar mirror keep their own offsets and never read a record twice.
+        """
+        records = []
+        parse = self.record_type.parse
+        for start, line in read_lines(path, offset):
+            record = parse(line)
+            if record is not None:
+                records.append(record)
+            offset = start + len(line.encode()) + 1
+        return records, offset
+
+    def parsed(self, path):
+        """ParsedRecords of one shard, keeping the most recently used CACHED_SHARDS"""
+        parsed = self._parsed.pop(path, None)
+        if parsed is None:
+            parsed = ParsedRecords(path, self.record_type)
+        self._parsed[path] = parsed  # re-insert so the dict stays in LRU order
+        while len(self._parsed) > CACHED_SHARDS:
+            del self._parsed[next(iter(self._parsed))]
+        return parsed
+
+
+def _read_head(path):
+    with open(path, "rb") as file:
+        return file.read(HEAD_BYTES).decode(errors="replace")
+
+
+class Rollup:
+    """Per-day and per-month sales, purchase and cost-of-goods-sold totals
+    for the P&L screen.
+
+    The totals are saved to `rollup_file` together with how many bytes of
+    each record shard they cover. `update()` only parses what was appended
+    since then, and rebuilds from scratch if a record file was truncated
+    or rewritten. A rebuild is spread over `workers` processes
+    (None: one per CPU) through parallel.aggregate().
+
+    Each shard's mtime/size is kept in memory, so an update only opens
+    the shards whose signature changed and a query with nothing new
+    costs a stat per shard. The file is saved after a rebuild, once
+    SAVE_BYTES of new records have been added and at exit, not after
+    every sale. An older save is still consistent, since its offsets
+    match its totals, so the next start just reads a longer tail.
+    """
+
+    def __init__(self, sell_shards, purchase_shards, rollup_file, workers=None):
+        self.rollup_file = rollup_file
+        self.workers = workers
+        self.kinds = [(sell_shards, 0), (purchase_shards, 1)]  # (shards, slot in the totals)
+        self.sources = {}  # record file -> (shards, slot)
+        self.days = {}    # "YYYY-MM-DD" -> [sales, purchases, cost of goods sold]
+        self.months = {}  # "YYYY-MM" -> [sales, purchases, cost of goods sold]
+        self.offsets = {}  # record file -> {"offset": bytes read, "head": first bytes}
+        self._sigs = {}    # record file -> signature when its tail was last read
+        self._unsaved = 0  # record bytes added since the rollup file was saved
+        self._loaded = False
+        self._at_exit = False
+
+    def _load(self):
+        self._loaded = True
+        if not os.path.exists(self.rollup_file):
+            return
+        try:
+            with open(self.rollup_file, "r") as file:
+                data = json.load(file)
+            self.days = data["days"]
+            self.offsets = data["offsets"]
+        except (ValueError, KeyError):
+            self._reset()
+            return
+        if any(len(totals) != 3 for totals in self.days.values()):
+            self._reset()  # saved before the cost of goods sold was tracked
+            return
+        self.months = {}
+        for day, day_totals in self.days.items():
+            totals = self.months.setdefault(day[:7], [0, 0, 0])
+            for slot, amount in enumerate(day_totals):
+                totals[slot] += amount
+
+    def _reset(self):
+        self.days = {}
+        self.months = {}
+        self.offsets = {}
+        self._sigs = {}
+
+    def save(self):
+        atomic_write(self.rollup_file, json.dumps({"days": self.days, "offsets": self.offsets}))
+        self._unsaved = 0
+
+    def flush(self):
+        """Save the totals if records were added since the last save"""
+        if self._unsaved:
+            self.save()
+
+    @metrics.phased("read")
+    def update(self):
+        """Bring the totals up to date with the record files"""
+        if not self._loaded:
+            self._load()
+        sources = {}
+        for shards, slot in self.kinds:
+            for path in shards.paths():
+                sources[path] = (shards, slot)
+        sigs = {path: file_signature(path) for path in sources}
+        changed = [path for path in sources if sigs[path] != self._sigs.get(path)]
+        gone = [path for path in self.offsets if path not in sources]
+        if not changed and not gone:
+            return
+        self.sources = sources
+        if gone or any(self._stale(path) for path in changed):
+            # a shard left the manifest or was rewritten
+            self._reset()
+            changed = list(sources)
+        if not self.offsets and self.sources:
+            self._rebuild()
+            self._unsaved = SAVE_BYTES  # a rebuild is always saved
+        for path in changed:
+            self._unsaved += self._read_tail(path)
+            self._sigs[path] = sigs[path]
+        if self._unsaved >= SAVE_BYTES:
+            self.save()
+        elif self._unsaved and not self._at_exit:
+            atexit.register(self.flush)
+            self._at_exit = True
+
+    def _stale(self, path):
+        seen = self.offsets.get(path)
+        if seen is None:
+            return False
+        if not os.path.exists(path):
+            return seen["offset"] > 0
+        if os.path.getsize(path) < seen["offset"]:
+            return True
+        return not _read_head(path).startswith(seen["head"])
+
+    def _rebuild(self):
+        """Recount every record file from scratch, chunked across processes"""
+        from parallel import aggregate
+
+        sources = []
+        for shards, slot in self.kinds:
+            for path in shards.paths():
+                sources.append((slot, path, shards.record_type))
+        totals, covered = aggregate(sources, workers=self.workers)
+        for slot, partial in totals.items():
+            for day, amount in partial.daily.items():
+                self.days.setdefault(day, [0, 0, 0])[slot] += amount
+                self.months.setdefault(day[:7], [0, 0, 0])[slot] += amount
+            for day, cost in partial.daily_cost.items():
+                self.days[day][2] += cost
+                self.months[day[:7]][2] += cost
+        for path in self.sources:
+            offset = covered.get(path, 0)
+            self.offsets[path] = {"offset": offset, "head": _read_head(path)[:offset] if offset else ""}
+
+    def _read_tail(self, path):
+        """Add the records appended to `path` since the last update,
+        returns how many bytes that was"""
+        if not os.path.exists(path):
+            return 0
+        shards, slot = self.sources[path]
+        seen = self.offsets.setdefault(path, {"offset": 0, "head": ""})
+        start = seen["offset"]
+        if os.path.getsize(path) == start:
+            return 0
+        records, seen["offset"] = shards.tail(path, start)
+        for record in records:
+            totals = self.days.setdefault(record.day, [0, 0, 0])
+            month = self.months.setdefault(record.day[:7], [0, 0, 0])
+            totals[slot] += record.amount
+            month[slot] += record.amount
+            cost = getattr(record, "cost", 0)
+            if cost:
+                totals[2] += cost
+                month[2] += cost
+        if start < HEAD_BYTES:
+            seen["head"] = _read_head(path)[:seen["offset"]]
+        return seen["offset"] - start
+
+    # ---------- queries ----------
+
+    def day(self, day):
+        """(sales, purchases, cost of goods sold) on one date"""
+        self.update()
+        return tuple(self.days.get(day.isoformat(), (0, 0, 0)))
+
+    def month(self, year, month):
+        """(sales, purchases, cost of goods sold) in one calendar month"""
+        self.update()
+        return tuple(self.months.get(f"{year:04d}-{month:02d}", (0, 0, 0)))
+
+    def between(self, start, end):
+        """(sales, purchases, cost of goods sold) from `start` to `end`, both dates included"""
+        self.update()
+        sales = purchases = cost = 0
+        day = start
+        while day <= end:
+            totals = self.days.get(day.isoformat())
+            if totals:
+                sales += totals[0]
+                purchases += totals[1]
+                cost += totals[2]
+            day += timedelta(days=1)
+        return sales, purchases, cost
@@ -0,0 +1,98 @@
+import csv
+import heapq
+from operator import itemgetter
+
+REPORTS = {
+    "top-items": ("Top items by revenue", ["Item", "Revenue"]),
+    "top-customers": ("Top customers by revenue", ["Customer", "Revenue"]),
+    "margin": ("Per-item margin", ["Item", "Revenue", "Cost of Goods Sold", "Margin", "Margin %", "Purchases"]),
+    "daily": ("Daily revenue", ["Date", "Revenue", "Purchases"]),
+}
+
+
+class Summary:
+    """Totals gathered in one pass over the sales and one over the purchases"""
+
+    def __init__(self):
+        self.item_revenue = {}
+        self.customer_revenue = {}
+        self.item_cost_of_sales = {}
+        self.item_purchases = {}
+        self.daily_revenue = {}
+        self.daily_purchases = {}
+
+    def add_sales(self, sales):
+        item_revenue = self.item_revenue
+        customer_revenue = self.customer_revenue
+        item_cost = self.item_cost_of_sales
+        daily = self.daily_revenue
+        for sale in sales:
+            item, amount, day = sale.item, sale.amount, sale.day
+            item_revenue[item] = item_revenue.get(item, 0) + amount
+            customer_revenue[sale.customer] = customer_revenue.get(sale.customer, 0) + amount
+            daily[day] = daily.get(day, 0) + amount
+            if sale.cost:
+                item_cost[item] = item_cost.get(item, 0) + sale.cost
+
+    def add_purchases(self, purchases):
+        item_purchases = self.item_purchases
+        daily = self.daily_purchases
+        for _, item, _, amount, day in purchases:
+            item_purchases[item] = item_purchases.get(item, 0) + amount
+            daily[day] = daily.get(day, 0) + amount
+
+
+    def add_partials(self, sales, purchases):
+        """Take totals already summed by parallel.aggregate()"""
+        if sales:
+            self.item_revenue = sales.items
+            self.customer_revenue = sales.parties
+            self.daily_revenue = sales.daily
+            self.item_cost_of_sales = sales.item_cost
+        if purchases:
+            self.item_purchases = purchases.items
+            self.daily_purchases = purchases.daily
+
+
+def summarize(storage, start=None, end=None):
+    """Stream the records in [start, end] once into a Summary.
+
+    Storage that can sum its records in worker processes (the text
+    backend's aggregate()) does so instead of streaming them here.
+    """
+    summary = Summary()
+    if hasattr(storage, "aggregate"):
+        summary.add_partials(*storage.aggregate(start, end))
+        return summary
+    summary.add_sales(storage.iter_sales(start, end))
+    summary.add_purchases(storage.iter_purchases(start, end))
+    return summary
+
+
+def report_rows(summary, name, top=10):
+    """Rows of one report, matching the columns in REPORTS[name]"""
+    if name == "top-items":
+        return heapq.nlargest(top, summary.item_revenue.items(), key=itemgetter(1))
+    if name == "top-customers":
+        return heapq.nlargest(top, summary.customer_revenue.items(), key=itemgetter(1))
+    if name == "margin":
+        rows = []
+        # Margin is revenue less what the goods sold cost (FIFO), not
+        # less everything bought; purchase spend has its own column
+        for item in sorted(summary.item_revenue.keys() | summary.item_purchases.keys()):
+            revenue = summary.item_revenue.get(item, 0)
+            cost = summary.item_cost_of_sales.get(item, 0)
+            percent = round((revenue - cost) / revenue * 100, 1) if revenue else ""
+            rows.append((item, revenue, cost, revenue - cost, percent, summary.item_purchases.get(item, 0)))
+        return rows
+    if name == "daily":
+        days = sorted(summary.daily_revenue.keys() | summary.daily_purchases.keys())
+        return [(day, summary.daily_revenue.get(day, 0), summary.daily_purchases.get(day, 0)) for day in days]
+    raise ValueError(f"unknown report {name!r}")
+
+
+def export_csv(path, header, rows):
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
@@ -0,0 +1,440 @@
+import asyncio
+import json
+import socket
+from datetime import date
+from itertools import islice
+
+from records import Purchase, Sale
+from store import PrefixIndex
+
+# Requests are one JSON object per line: {"id": 1, "op": "sell", ...}.
+# Replies echo the id: {"id": 1, "ok": true, "result": ...} or
+# {"id": 1, "ok": false, "error": "..."}. Dates travel as "YYYY-MM-DD".
+
+WRITE_OPS = {"sell", "sell_many", "purchase", "purchase_many", "add_item", "drop_item", "set_reorder_level"}
+MAX_BATCH = 256  # most queued writes committed together
+PAGE_ROWS = 200  # records per reply when a terminal lists sales or purchases
+MAX_CURSORS = 8  # open listings kept per connection, the oldest is dropped first
+
+
+def _day(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _record_rows(records):
+    return [list(record) + ([record.cost] if isinstance(record, Sale) else []) for record in records]
+
+
+class TransactionServer:
+    """Serves one storage to many terminals over a JSON-lines socket.
+
+    The storage stays open for the life of the server, so the catalog,
+    stock and P&L rollup are parsed once and kept in memory. Reads are
+    answered straight away. Writes go through a queue to a single writer
+    task, which commits every write waiting in the queue at once: runs of
+    sales become one sell_many() and runs of purchases one
+    purchase_many(), so a busy server appends and fsyncs once per batch.
+    With a storage that can defer its fsyncs (TextStorage), the batch's
+    fsyncs run in a worker thread and reads go on meanwhile; replies to
+    the writes are only sent once they are on disk.
+
+    Sales and purchase listings are sent PAGE_ROWS records at a time. A
+    reply carries a cursor while records are left, and the terminal asks
+    for the next page with it, so no listing is built whole in memory or
+    holds up the other terminals.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.queue = None
+        self.batches = 0  # write batches committed, for monitoring
+        self._cursor_ids = 0
+
+    # ---------- reads ----------
+
+    def read(self, op, request, cursors=None):
+        storage = self.storage
+        if op == "ping":
+            return "pong"
+        if op == "items":
+            return storage.items()
+        if op == "catalog":
+            return storage.catalog()
+        if op == "price":
+            return storage.price(request["name"])
+        if op == "find":
+            return storage.find(request["name"])
+        if op == "matches":
+            return storage.prefix_index().matches(request.get("prefix", ""), request.get("limit"))
+        if op == "search":
+            return storage.fuzzy_index().search(request.get("query", ""), request.get("limit"))
+        if op == "quantity":
+            return storage.quantity(request["name"])
+        if op == "inventory":
+            return storage.inventory()
+        if op == "lots":
+            return storage.lots(request["name"])
+        if op == "valuation":
+            return storage.valuation()
+        if op == "reorder_level":
+            return storage.reorder_level(request["name"])
+        if op == "low_stock":
+            return storage.low_stock()
+        if op == "totals":
+            period = request.get("period")
+            if period == "day":
+                return storage.day_totals(_day(request["day"]))
+            if period == "month":
+                return storage.month_totals(request["year"], request["month"])
+            return storage.range_totals(_day(request["start"]), _day(request["end"]))
+        if op in ("sales", "purchases"):
+            party = "customer" if op == "sales" else "supplier"
+            records = getattr(storage, "iter_" + op)(
+                _day(request.get("start")), _day(request.get("end")),
+                request.get(party), request.get("item"), request.get("newest_first", False),
+            )
+            return self._page(iter(records), cursors, request.get("page", PAGE_ROWS))
+        if op == "next":
+            records = cursors.pop(request["cursor"], None)
+            if records is None:
+                raise ValueError("listing expired, start it again")
+            return self._page(records, cursors, request.get("page", PAGE_ROWS))
+        raise ValueError(f"unknown op {op!r}")
+
+    def _page(self, records, cursors, size):
+        """The next `size` records, plus a cursor for the rest if any are left"""
+        rows = _record_rows(islice(records, size))
+        if len(rows) < size or cursors is None:
+            return {"rows": rows, "cursor": None}
+        while len(cursors) >= MAX_CURSORS:
+            del cursors[next(iter(cursors))]  # abandoned listings
+        self._cursor_ids += 1
+        cursors[self._cursor_ids] = records
+        return {"rows": rows, "cursor": self._cursor_ids}
+
+    # ---------- writes ----------
+
+    async def writer(self):
+        """Commit queued writes in batches, one batch at a time"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            deferred_sync = getattr(self.storage, "deferred_sync", None)
+            if deferred_sync is None:
+                self.commit(batch)
+            else:
+                # The appends stay on the loop, where every other storage
+                # call runs; only the fsyncs move to a thread
+                staged = [(request, loop.create_future()) for request, _ in batch]
+                with deferred_sync() as tickets:
+                    self.commit(staged)
+                error = None
+                if tickets:
+                    try:
+                        await asyncio.to_thread(self.storage.sync, tickets)
+                    except Exception as e:
+                        error = e
+                for (_, done), (_, future) in zip(staged, batch):
+                    if error is not None:
+                        future.set_exception(error)
+                    elif done.exception() is not None:
+                        future.set_exception(done.exception())
+                    else:
+                        future.set_result(done.result())
+            self.batches += 1
+
+    def commit(self, batch):
+        """Apply (request, future) pairs in order, grouping neighbouring
+        sales and neighbouring purchases into one write each"""
+        i = 0
+        while i < len(batch):
+            op = batch[i][0]["op"]
+            j = i + 1
+            if op in ("sell", "purchase"):
+                while j < len(batch) and batch[j][0]["op"] == op:
+                    j += 1
+            try:
+                if op == "sell":
+                    self._sell_run(batch[i:j])
+                elif op == "purchase":
+                    rows = [self._purchase_row(request) for request, _ in batch[i:j]]
+                    self.storage.purchase_many(rows)
+                    for _, future in batch[i:j]:
+                        future.set_result(True)
+                else:
+                    request, future = batch[i]
+                    future.set_result(self._write_one(op, request))
+            except Exception as e:
+                for _, future in batch[i:j]:
+                    if not future.done():
+                        future.set_exception(e)
+            i = j
+
+    def _sell_run(self, run):
+        """Single sales from different terminals: each one is checked
+        against the stock left by the ones before it, then all accepted
+        sales are written together"""
+        stock = {}
+        accepted = []
+        for request, future in run:
+            try:
+                row = self._sell_row(request)
+            except (KeyError, TypeError, ValueError) as e:
+                future.set_exception(e)
+                continue
+            item, quantity = row[1], row[2]
+            if item not in stock:
+                stock[item] = self.storage.quantity(item) or 0
+            if stock[item] < quantity:
+                future.set_result(False)
+                continue
+            stock[item] -= quantity
+            accepted.append((row, future))
+        if not accepted:
+            return
+        # Another terminal writing the files directly could still empty the
+        # shelf in between; sell_many() then refuses the whole batch, so
+        # fall back to one sale at a time
+        if self.storage.sell_many([row for row, _ in accepted]):
+            for _, future in accepted:
+                future.set_result(True)
+        else:
+            for row, future in accepted:
+                future.set_result(self.storage.sell(*row))
+
+    def _write_one(self, op, request):
+        storage = self.storage
+        if op == "sell_many":
+            return storage.sell_many([self._sell_row(row) for row in request["rows"]])
+        if op == "purchase_many":
+            storage.purchase_many([self._purchase_row(row) for row in request["rows"]])
+            return True
+        if op == "add_item":
+            storage.add_item(request["name"], float(request["price"]))
+            return True
+        if op == "drop_item":
+            return storage.drop_item(request["name"])
+        if op == "set_reorder_level":
+            level = request.get("level")
+            storage.set_reorder_level(request["name"], None if level is None else int(level))
+            return True
+        raise ValueError(f"unknown op {op!r}")
+
+    @staticmethod
+    def _sell_row(request):
+        return (request["customer"], request["item"], int(request["quantity"]),
+                float(request["amount"]), _day(request["day"]))
+
+    @staticmethod
+    def _purchase_row(request):
+        return (request["supplier"], request["item"], int(request["quantity"]),
+                float(request["unit_price"]), _day(request["day"]))
+
+    # ---------- connections ----------
+
+    async def handle(self, reader, writer):
+        cursors = {}  # this connection's open listings: cursor id -> record iterator
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.respond(line, cursors)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line, cursors=None):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            op = request["op"]
+            if op in WRITE_OPS:
+                future = asyncio.get_running_loop().create_future()
+                await self.queue.put((request, future))
+                result = await future
+            else:
+                result = self.read(op, request, cursors)
+            return {"id": request_id, "ok": True, "result": result}
+        except Exception as e:
+            return {"id": request_id, "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        self.queue = asyncio.Queue()
+        writer_task = asyncio.create_task(self.writer())
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+
+
+def serve(storage, host="127.0.0.1", port=8765, unix_path=None):
+    """Run the server until interrupted"""
+    server = TransactionServer(storage)
+    try:
+        asyncio.run(server.serve(host, port, unix_path))
+    except KeyboardInterrupt:
+        pass
+
+
+class RemoteStorage:
+    """Storage methods answered by a TransactionServer, for terminals.
+
+    `address` is "host:port" or the path of a Unix socket. Records come
+    back as Sale/Purchase objects, so the menu screens work unchanged.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._file = None
+        self._next_id = 0
+        self._prefix_index = None
+
+    def _connect(self):
+        if ":" in self.address:
+            host, port = self.address.rsplit(":", 1)
+            sock = socket.create_connection((host, int(port)))
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+        self._file = sock.makefile("rwb")
+
+    def call(self, op, **params):
+        if self._file is None:
+            self._connect()
+        self._next_id += 1
+        params.update(op=op, id=self._next_id)
+        self._file.write(json.dumps(params, default=str).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            self._file = None
+            raise ConnectionError(f"server at {self.address} closed the connection")
+        reply = json.loads(line)
+        if not reply["ok"]:
+            raise RuntimeError(reply["error"])
+        return reply["result"]
+
+    # ---------- catalog ----------
+
+    def items(self):
+        return self.call("items")
+
+    def catalog(self):
+        return self.call("catalog")
+
+    def price(self, name):
+        return self.call("price", name=name)
+
+    def find(self, name):
+        return self.call("find", name=name)
+
+    def prefix_index(self):
+        return PrefixIndex(self.items())
+
+    def fuzzy_index(self):
+        return RemoteSearch(self)
+
+    def add_item(self, name, price):
+        self.call("add_item", name=name, price=price)
+
+    # ---------- stock ----------
+
+    def quantity(self, name):
+        return self.call("quantity", name=name)
+
+    def inventory(self):
+        return [tuple(row) for row in self.call("inventory")]
+
+    def drop_item(self, name):
+        return self.call("drop_item", name=name)
+
+    def lots(self, name):
+        return [tuple(lot) for lot in self.call("lots", name=name)]
+
+    def valuation(self):
+        return self.call("valuation")
+
+    # ---------- reorder alerts ----------
+
+    def reorder_level(self, name):
+        return self.call("reorder_level", name=name)
+
+    def set_reorder_level(self, name, level):
+        self.call("set_reorder_level", name=name, level=level)
+
+    def low_stock(self):
+        return [tuple(row) for row in self.call("low_stock")]
+
+    # ---------- transactions ----------
+
+    def sell(self, customer, item, quantity, amount, day):
+        return self.call("sell", customer=customer, item=item, quantity=quantity, amount=amount, day=day)
+
+    def sell_many(self, rows):
+        keys = ("customer", "item", "quantity", "amount", "day")
+        return self.call("sell_many", rows=[dict(zip(keys, row)) for row in rows])
+
+    def purchase(self, supplier, item, quantity, unit_price, day):
+        self.call("purchase", supplier=supplier, item=item, quantity=quantity, unit_price=unit_price, day=day)
+
+    def purchase_many(self, rows):
+        keys = ("supplier", "item", "quantity", "unit_price", "day")
+        self.call("purchase_many", rows=[dict(zip(keys, row)) for row in rows])
+
+    # ---------- records ----------
+
+    def _records(self, record_type, op, **params):
+        """Records fetched a page at a time, as the caller gets to them"""
+        reply = self.call(op, **params)
+        while True:
+            for row in reply["rows"]:
+                yield record_type(*row)
+            if reply["cursor"] is None:
+                return
+            reply = self.call("next", cursor=reply["cursor"])
+
+    def iter_sales(self, start=None, end=None, customer=None, item=None, newest_first=False):
+        return self._records(Sale, "sales", start=start, end=end, customer=customer, item=item,
+                             newest_first=newest_first)
+
+    def iter_purchases(self, start=None, end=None, supplier=None, item=None, newest_first=False):
+        return self._records(Purchase, "purchases", start=start, end=end, supplier=supplier, item=item,
+                             newest_first=newest_first)
+
+    # ---------- P&L ----------
+
+    def day_totals(self, day):
+        return tuple(self.call("totals", period="day", day=day))
+
+    def month_totals(self, year, month):
+        return tuple(self.call("totals", period="month", year=year, month=month))
+
+    def range_totals(self, start, end):
+        return tuple(self.call("totals", period="range", start=start, end=end))
+
+
+class RemoteSearch:
+    """Stands in for a TrigramIndex on a terminal: searches run on the
+    server, which keeps the index built, instead of indexing the whole
+    catalog again here for every picker"""
+
+    def __init__(self, remote):
+        self.remote = remote
+
+    def matches(self, prefix, limit=None):
+        return self.remote.call("matches", prefix=prefix, limit=limit)
+
+    def search(self, query, limit=None):
+        return self.remote.call("search", query=query, limit=limit)
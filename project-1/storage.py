@@ -0,0 +1,607 @@
+import os
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import metrics
+from locks import GroupCommit
+from records import PURCHASE_DATE, SELL_DATE, Purchase, RecordShards, Rollup, Sale
+from store import DataStore, PrefixIndex, TrigramIndex
+
+
+def _filter_records(records, start, end, party, item):
+    """Keep Sale/Purchase records within [start, end] for the given
+    customer/supplier and item.
+
+    Dates compare as ISO strings; names compare case-insensitively. None
+    means "no filter".
+    """
+    start = start.isoformat() if start else None
+    end = end.isoformat() if end else None
+    party = party.lower() if party else None
+    item = item.lower() if item else None
+    for record in records:
+        if start and record.day < start:
+            continue
+        if end and record.day > end:
+            continue
+        if party and record.party.lower() != party:
+            continue
+        if item and record.item.lower() != item:
+            continue
+        yield record
+
+
+class TextStorage:
+    """The original comma-separated text files.
+
+    Every storage backend offers the same methods, so the menus can run
+    on either one:
+
+    * catalog: items(), catalog(), price(), find(), prefix_index(),
+      fuzzy_index(), add_item()
+    * stock: quantity(), inventory(), drop_item(), lots(), valuation()
+    * reorder alerts: reorder_level(), set_reorder_level(), low_stock()
+    * transactions: sell(), sell_many(), purchase(), purchase_many()
+    * records: iter_sales(), iter_purchases()
+    * P&L totals (sales, purchases, cost of goods sold): day_totals(),
+      month_totals(), range_totals()
+    """
+
+    def __init__(self, item_file, inventory_file, ledger_file, sell_dir, purchase_dir, rollup_file,
+                 legacy_sell_file=None, legacy_purchase_file=None, workers=None, reorder_file=None):
+        self.store = DataStore(item_file, inventory_file, ledger_file, reorder_file=reorder_file)
+        self.sell_shards = RecordShards(sell_dir, SELL_DATE, Sale, legacy_sell_file, self.store.lock)
+        self.purchase_shards = RecordShards(purchase_dir, PURCHASE_DATE, Purchase, legacy_purchase_file,
+                                            self.store.lock)
+        self.rollup = Rollup(self.sell_shards, self.purchase_shards, rollup_file, workers)
+        self.workers = workers
+        self.journal = GroupCommit(ledger_file + ".journal")
+        self._deferred = None  # tickets held back inside deferred_sync()
+
+    @classmethod
+    def in_directory(cls, directory, workers=None):
+        """TextStorage over the usual file names inside `directory`"""
+        return cls(
+            os.path.join(directory, "item_name.txt"),
+            os.path.join(directory, "inventory.txt"),
+            os.path.join(directory, "inventory_ledger.txt"),
+            os.path.join(directory, "sell_records"),
+            os.path.join(directory, "purchase_records"),
+            os.path.join(directory, "pl_rollup.json"),
+            workers=workers,
+            reorder_file=os.path.join(directory, "reorder_levels.txt"),
+        )
+
+    # ---------- durability ----------
+
+    def _wait(self, ticket):
+        if self._deferred is not None:
+            self._deferred.append(ticket)
+        else:
+            self.journal.wait(ticket)
+
+    @contextmanager
+    def deferred_sync(self):
+        """Collect the fsyncs owed by the writes made inside the block
+        instead of waiting for them; sync() makes them durable later. The
+        server uses this to keep fsyncs off its event loop."""
+        self._deferred = tickets = []
+        try:
+            yield tickets
+        finally:
+            self._deferred = None
+
+    def sync(self, tickets):
+        """Return once the writes behind these tickets are on disk"""
+        for ticket in tickets:
+            self.journal.wait(ticket)
+
+    # ---------- catalog ----------
+
+    def items(self):
+        return self.store.items()
+
+    def catalog(self):
+        return self.store.catalog()
+
+    def price(self, name):
+        return self.store.price(name)
+
+    def find(self, name):
+        return self.store.find(name)
+
+    def prefix_index(self):
+        return self.store.prefix_index()
+
+    def fuzzy_index(self):
+        return self.store.fuzzy_index()
+
+    def add_item(self, name, price):
+        with self.store.transaction():
+            self.store.add_item(name, price)
+            ticket = self.journal.mark(self.store.item_file)
+        self._wait(ticket)
+
+    # ---------- stock ----------
+
+    def quantity(self, name):
+        return self.store.quantity(name)
+
+    def inventory(self):
+        return self.store.inventory()
+
+    def drop_item(self, name):
+        """Take an item out of inventory. False if it was not stocked."""
+        with self.store.transaction():
+            if not self.store.drop_item(name):
+                return False
+            ticket = self.journal.mark(self.store.ledger_file)
+        self._wait(ticket)
+        return True
+
+    def lots(self, name):
+        return self.store.lots_of(name)
+
+    def valuation(self):
+        return self.store.valuation()
+
+    # ---------- reorder alerts ----------
+
+    def reorder_level(self, name):
+        return self.store.reorder_level(name)
+
+    def set_reorder_level(self, name, level):
+        with self.store.transaction():
+            self.store.set_reorder_level(name, level)
+            ticket = self.journal.mark(self.store.reorder_file)
+        self._wait(ticket)
+
+    def low_stock(self):
+        return self.store.low_stock()
+
+    # ---------- transactions ----------
+
+    def sell(self, customer, item, quantity, amount, day):
+        """Take stock out and record the sale. False if stock ran short."""
+        return self.sell_many([(customer, item, quantity, amount, day)])
+
+    def sell_many(self, rows):
+        """Record (customer, item, quantity, amount, date) sales together.
+
+        Nothing is written unless there is stock for every row. Each file
+        gets a single write for the whole batch. The stock check and the
+        writes happen under the store's file lock, so two terminals can't
+        both sell the last unit; the fsync waits until the lock is released
+        so concurrent sales, from this or other terminals, share it.
+        """
+        needed = {}
+        for _, item, quantity, _, _ in rows:
+            needed[item] = needed.get(item, 0) + quantity
+        with self.store.transaction() as store:
+            with metrics.phase("validate"):
+                for item, quantity in needed.items():
+                    in_stock = store.stock.get(item)
+                    if in_stock is None or in_stock < quantity:
+                        return False
+            costs = store.remove_stock_many([(item, quantity) for _, item, quantity, _, _ in rows])
+            shard_paths = self.sell_shards.append([
+                f"{customer},{item},{amount},{day},{cost}\n"
+                for (customer, item, _, amount, day), cost in zip(rows, costs)
+            ])
+            ticket = self.journal.mark(store.ledger_file, *shard_paths)
+        self._wait(ticket)
+        self.rollup.update()
+        return True
+
+    def purchase(self, supplier, item, quantity, unit_price, day):
+        self.purchase_many([(supplier, item, quantity, unit_price, day)])
+
+    def purchase_many(self, rows):
+        """Record (supplier, item, quantity, unit price, date) purchases together"""
+        with self.store.transaction() as store:
+            shard_paths = self.purchase_shards.append([
+                f"{supplier},{item},{quantity},{unit_price * quantity},{day}\n"
+                for supplier, item, quantity, unit_price, day in rows
+            ])
+            store.add_stock_many([(item, quantity, unit_price) for _, item, quantity, unit_price, _ in rows])
+            ticket = self.journal.mark(store.ledger_file, *shard_paths)
+        self._wait(ticket)
+        self.rollup.update()
+
+    # ---------- records ----------
+
+    def iter_sales(self, start=None, end=None, customer=None, item=None, newest_first=False):
+        """Sale records (customer, item, amount, date) matching the filters"""
+        records = self.sell_shards.records(start, end, newest_first)
+        return _filter_records(records, start, end, customer, item)
+
+    def iter_purchases(self, start=None, end=None, supplier=None, item=None, newest_first=False):
+        """Purchase records (supplier, item, quantity, amount, date) matching the filters"""
+        records = self.purchase_shards.records(start, end, newest_first)
+        return _filter_records(records, start, end, supplier, item)
+
+    def aggregate(self, start=None, end=None):
+        """(sales, purchases) parallel.Partial totals by day, item and party
+        within [start, end], summed over the shards by worker processes"""
+        from parallel import aggregate
+
+        sources = [("sales", path, Sale) for path in self.sell_shards.paths(start, end)]
+        sources += [("purchases", path, Purchase) for path in self.purchase_shards.paths(start, end)]
+        totals, _ = aggregate(sources, start, end, self.workers)
+        return totals.get("sales"), totals.get("purchases")
+
+    # ---------- P&L ----------
+
+    def day_totals(self, day):
+        return self.rollup.day(day)
+
+    def month_totals(self, year, month):
+        return self.rollup.month(year, month)
+
+    def range_totals(self, start, end):
+        return self.rollup.between(start, end)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    name TEXT PRIMARY KEY,
+    lower_name TEXT NOT NULL,
+    price REAL NOT NULL,
+    reorder_level INTEGER
+);
+CREATE INDEX IF NOT EXISTS items_lower_name ON items (lower_name);
+-- Bumped whenever the set of item names changes, by any connection, so
+-- the cached name indexes don't have to be rebuilt after every sale
+CREATE TABLE IF NOT EXISTS catalog_version (version INTEGER NOT NULL);
+INSERT INTO catalog_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalog_version);
+CREATE TRIGGER IF NOT EXISTS items_added AFTER INSERT ON items
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS items_removed AFTER DELETE ON items
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS items_renamed AFTER UPDATE OF name ON items
+BEGIN UPDATE catalog_version SET version = version + 1; END;
+CREATE TABLE IF NOT EXISTS stock (
+    name TEXT PRIMARY KEY,
+    quantity INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lots (
+    id INTEGER PRIMARY KEY,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_cost REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lots_item ON lots (item, id);
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY,
+    customer TEXT NOT NULL,
+    item TEXT NOT NULL,
+    amount REAL NOT NULL,
+    day TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sales_day ON sales (day);
+CREATE INDEX IF NOT EXISTS sales_item ON sales (item);
+CREATE TABLE IF NOT EXISTS purchases (
+    id INTEGER PRIMARY KEY,
+    supplier TEXT NOT NULL,
+    item TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS purchases_day ON purchases (day);
+CREATE INDEX IF NOT EXISTS purchases_item ON purchases (item);
+"""
+
+
+class SqliteStorage:
+    """Items, stock, sales and purchases in indexed SQLite tables (WAL mode).
+
+    Same methods as TextStorage. A sale's stock check and decrement happen
+    in one transaction, and the P&L totals are aggregate queries. Cost lots
+    are rows of the lots table, consumed in id order.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._conn = None
+        self._prefix_index = None
+        self._prefix_version = None
+        self._fuzzy_index = None
+        self._fuzzy_version = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3  # only paid for when the SQLite backend is used
+            self._conn = sqlite3.connect(self.db_file, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._upgrade()
+        return self._conn
+
+    def _upgrade(self):
+        """Add columns that databases made by older versions lack"""
+        conn = self._conn
+        if "cost" not in [row[1] for row in conn.execute("PRAGMA table_info(sales)")]:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("ALTER TABLE sales ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+            # Stock bought before lots were kept has no known cost
+            conn.execute("INSERT INTO lots (item, quantity, unit_cost) "
+                         "SELECT name, quantity, 0 FROM stock WHERE quantity > 0")
+            conn.execute("COMMIT")
+        if "reorder_level" not in [row[1] for row in conn.execute("PRAGMA table_info(items)")]:
+            conn.execute("ALTER TABLE items ADD COLUMN reorder_level INTEGER")
+        # Only items with a level are indexed, so the low-stock query skips the rest
+        conn.execute("CREATE INDEX IF NOT EXISTS items_reorder ON items (name) WHERE reorder_level IS NOT NULL")
+
+    # ---------- catalog ----------
+
+    def items(self):
+        return [row[0] for row in self.conn.execute("SELECT name FROM items ORDER BY rowid")]
+
+    def catalog(self):
+        return dict(self.conn.execute("SELECT name, price FROM items ORDER BY rowid"))
+
+    def price(self, name):
+        row = self.conn.execute("SELECT price FROM items WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def find(self, name):
+        row = self.conn.execute(
+            "SELECT name FROM items WHERE lower_name = ? LIMIT 1", (name.strip().lower(),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _catalog_state(self):
+        return self.conn.execute("SELECT max(version) FROM catalog_version").fetchone()[0]
+
+    def prefix_index(self):
+        version = self._catalog_state()
+        if self._prefix_version != version:
+            self._prefix_index = PrefixIndex(self.items())
+            self._prefix_version = version
+        return self._prefix_index
+
+    def fuzzy_index(self):
+        version = self._catalog_state()
+        if self._fuzzy_version != version:
+            self._fuzzy_index = TrigramIndex(self.items())
+            self._fuzzy_version = version
+        return self._fuzzy_index
+
+    def add_item(self, name, price):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            indexed = self._fuzzy_version == self._catalog_state() and self.price(name) is None
+            conn.execute(
+                "INSERT INTO items (name, lower_name, price) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET lower_name = excluded.lower_name, price = excluded.price",
+                (name, name.lower(), price),
+            )
+            version = self._catalog_state()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if indexed:
+            self._fuzzy_index.add(name)  # keep the index instead of rebuilding it
+            self._fuzzy_version = version
+
+    # ---------- stock ----------
+
+    def quantity(self, name):
+        row = self.conn.execute("SELECT quantity FROM stock WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def inventory(self):
+        return self.conn.execute("SELECT name, quantity FROM stock ORDER BY rowid").fetchall()
+
+    def drop_item(self, name):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            found = conn.execute("DELETE FROM stock WHERE name = ?", (name,)).rowcount > 0
+            conn.execute("DELETE FROM lots WHERE item = ?", (name,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return found
+
+    def lots(self, name):
+        return self.conn.execute(
+            "SELECT quantity, unit_cost FROM lots WHERE item = ? ORDER BY id", (name,)
+        ).fetchall()
+
+    def valuation(self):
+        return dict(self.conn.execute(
+            "SELECT item, SUM(quantity * unit_cost) FROM lots GROUP BY item ORDER BY MIN(id)"
+        ))
+
+    def reorder_level(self, name):
+        row = self.conn.execute("SELECT reorder_level FROM items WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_reorder_level(self, name, level):
+        self.conn.execute("UPDATE items SET reorder_level = ? WHERE name = ?", (level, name))
+
+    def low_stock(self):
+        return self.conn.execute(
+            "SELECT items.name, COALESCE(stock.quantity, 0) AS quantity, reorder_level "
+            "FROM items INDEXED BY items_reorder LEFT JOIN stock ON stock.name = items.name "
+            "WHERE reorder_level IS NOT NULL AND COALESCE(stock.quantity, 0) <= reorder_level "
+            "ORDER BY quantity - reorder_level, items.name"
+        ).fetchall()
+
+    def _consume(self, item, quantity):
+        """Take `quantity` from the oldest lots of an item, returns their cost"""
+        conn = self.conn
+        cost = 0.0
+        for lot_id, lot_qty, unit_cost in conn.execute(
+            "SELECT id, quantity, unit_cost FROM lots WHERE item = ? ORDER BY id", (item,)
+        ).fetchall():
+            if quantity <= 0:
+                break
+            taken = min(lot_qty, quantity)
+            cost += taken * unit_cost
+            quantity -= taken
+            if taken == lot_qty:
+                conn.execute("DELETE FROM lots WHERE id = ?", (lot_id,))
+            else:
+                conn.execute("UPDATE lots SET quantity = ? WHERE id = ?", (lot_qty - taken, lot_id))
+        return cost
+
+    # ---------- transactions ----------
+
+    def sell(self, customer, item, quantity, amount, day):
+        """Take stock out and record the sale. False if stock ran short."""
+        return self.sell_many([(customer, item, quantity, amount, day)])
+
+    @metrics.phased("write")
+    def sell_many(self, rows):
+        """Record (customer, item, quantity, amount, date) sales in one transaction.
+
+        Rolls back and returns False if any row runs out of stock.
+        """
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            costs = []
+            for _, item, quantity, _, _ in rows:
+                cursor = conn.execute(
+                    "UPDATE stock SET quantity = quantity - ? WHERE name = ? AND quantity >= ?",
+                    (quantity, item, quantity),
+                )
+                if cursor.rowcount == 0:
+                    conn.execute("ROLLBACK")
+                    return False
+                costs.append(self._consume(item, quantity))
+            conn.executemany(
+                "INSERT INTO sales (customer, item, amount, day, cost) VALUES (?, ?, ?, ?, ?)",
+                [(customer, item, amount, str(day), cost)
+                 for (customer, item, _, amount, day), cost in zip(rows, costs)],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def purchase(self, supplier, item, quantity, unit_price, day):
+        self.purchase_many([(supplier, item, quantity, unit_price, day)])
+
+    @metrics.phased("write")
+    def purchase_many(self, rows):
+        """Record (supplier, item, quantity, unit price, date) purchases in one transaction"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO purchases (supplier, item, quantity, amount, day) VALUES (?, ?, ?, ?, ?)",
+                [(supplier, item, quantity, unit_price * quantity, str(day))
+                 for supplier, item, quantity, unit_price, day in rows],
+            )
+            conn.executemany(
+                "INSERT INTO stock (name, quantity) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET quantity = quantity + excluded.quantity",
+                [(item, quantity) for _, item, quantity, _, _ in rows],
+            )
+            conn.executemany(
+                "INSERT INTO lots (item, quantity, unit_cost) VALUES (?, ?, ?)",
+                [(item, quantity, unit_price) for _, item, quantity, unit_price, _ in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------- records ----------
+
+    def iter_sales(self, start=None, end=None, customer=None, item=None, newest_first=False):
+        """Sale records (customer, item, amount, date) for every matching sale"""
+        rows = self._select("SELECT customer, item, amount, day, cost FROM sales",
+                            "customer", start, end, customer, item, newest_first)
+        return (Sale(*row) for row in rows)
+
+    def iter_purchases(self, start=None, end=None, supplier=None, item=None, newest_first=False):
+        """(supplier, item, quantity, amount, date) for every matching purchase"""
+        return self._select("SELECT supplier, item, quantity, amount, day FROM purchases",
+                            "supplier", start, end, supplier, item, newest_first)
+
+    def _select(self, query, party_col, start, end, party, item, newest_first):
+        where = []
+        params = []
+        if start:
+            where.append("day >= ?")
+            params.append(start.isoformat())
+        if end:
+            where.append("day <= ?")
+            params.append(end.isoformat())
+        if party:
+            where.append(f"{party_col} = ? COLLATE NOCASE")
+            params.append(party)
+        if item:
+            where.append("item = ? COLLATE NOCASE")
+            params.append(item)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY id DESC" if newest_first else " ORDER BY id"
+        # A separate cursor so the rows stream while other queries run
+        return self.conn.cursor().execute(query, params)
+
+    # ---------- P&L ----------
+
+    def range_totals(self, start, end):
+        sales, cost = self.conn.execute(
+            "SELECT COALESCE(SUM(amount), 0), COALESCE(SUM(cost), 0) FROM sales WHERE day BETWEEN ? AND ?",
+            (start.isoformat(), end.isoformat()),
+        ).fetchone()
+        purchases = self.conn.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM purchases WHERE day BETWEEN ? AND ?",
+            (start.isoformat(), end.isoformat()),
+        ).fetchone()[0]
+        return sales, purchases, cost
+
+    def day_totals(self, day):
+        return self.range_totals(day, day)
+
+    def month_totals(self, year, month):
+        first = date(year, month, 1)
+        last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        return self.range_totals(first, last)
+
+    # ---------- migration ----------
+
+    def import_text(self, text):
+        """Copy everything from a TextStorage into this database"""
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for name in text.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO items (name, lower_name, price, reorder_level) VALUES (?, ?, ?, ?)",
+                    (name, name.lower(), text.price(name), text.reorder_level(name)),
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO stock (name, quantity) VALUES (?, ?)", text.inventory()
+            )
+            conn.executemany(
+                "INSERT INTO lots (item, quantity, unit_cost) VALUES (?, ?, ?)",
+                [(name, qty, cost) for name, _ in text.inventory() for qty, cost in text.lots(name)],
+            )
+            conn.executemany(
+                "INSERT INTO sales (customer, item, amount, day, cost) VALUES (?, ?, ?, ?, ?)",
+                ((*sale, sale.cost) for sale in text.iter_sales()),
+            )
+            conn.executemany(
+                "INSERT INTO purchases (supplier, item, quantity, amount, day) VALUES (?, ?, ?, ?, ?)",
+                (tuple(purchase) for purchase in text.iter_purchases()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
@@ -0,0 +1,603 @@
+import heapq
+import math
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import metrics
+from locks import FileLock, atomic_write
+
+
+def file_signature(path):
+    """Return (mtime, size) of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class PrefixIndex:
+    """Item names sorted by their lowercased form for prefix searches.
+
+    A prefix lookup is a bisect to the first candidate followed by a walk
+    that stops after `limit` names, so it costs O(log n + limit) no matter
+    how many items share the prefix.
+    """
+
+    def __init__(self, names):
+        pairs = sorted((name.lower(), name) for name in names)
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+
+    def matches(self, prefix, limit=None):
+        """Names starting with `prefix` (case-insensitive), in sorted order"""
+        prefix = prefix.lower()
+        found = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            found.append(self.names[i])
+            if limit is not None and len(found) >= limit:
+                break
+            i += 1
+        return found
+
+
+FUZZY_CUTOFF = 0.5  # share of the query's trigrams a fuzzy match must have
+
+
+def trigrams(text):
+    """Three-letter slices of `text`, lowercased and padded with spaces so
+    the start and the end of a name count as well"""
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(PrefixIndex):
+    """Item names indexed by their trigrams for typo-tolerant searches.
+
+    Every trigram maps to the ids of the items containing it. A name that
+    shares k of the query's q trigrams appears in at least one of the
+    q - k + 1 rarest of them, so a search walks the shortest lists first,
+    lowering k one list at a time, and stops as soon as `limit` names are
+    known to beat anything further down. Only those candidates are
+    compared, never the whole catalog. Queries under three letters fall
+    back to the prefix lookup.
+    """
+
+    def __init__(self, names, cutoff=FUZZY_CUTOFF):
+        super().__init__(names)
+        self.cutoff = cutoff
+        self.grams = defaultdict(list)  # trigram -> ids of the items containing it, ascending
+        self.entries = []  # item id -> (name, lowercased name, trigrams)
+        for name in self.names:
+            self._index(name)
+
+    def _index(self, name):
+        key = name.lower()
+        grams = trigrams(key)
+        number = len(self.entries)
+        self.entries.append((name, key, grams))
+        for gram in grams:
+            self.grams[gram].append(number)
+
+    def add(self, name):
+        """Index one more name without rebuilding"""
+        key = name.lower()
+        i = bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.names.insert(i, name)
+        self._index(name)
+
+    def search(self, query, limit=None):
+        """Names close to `query` (case-insensitive), best first: the exact
+        name, names starting with it, names containing it, then other
+        names by the number of trigrams they share with it"""
+        query = query.strip().lower()
+        if len(query) < 3:
+            return self.matches(query, limit)
+        entries = self.entries
+
+        # names containing the query hold every inner trigram, so the
+        # rarest one lists them all
+        inner = min((self.grams.get(query[i:i + 3], ()) for i in range(len(query) - 2)), key=len)
+        found = []
+        seen = set()
+        for number in inner:
+            name, key, _ = entries[number]
+            if query in key:
+                found.append((0 if key == query else 1 if key.startswith(query) else 2, 0, len(key), key, name))
+                seen.add(number)
+        if limit is not None and len(found) >= limit:
+            return [row[-1] for row in heapq.nsmallest(limit, found)]
+
+        wanted = trigrams(query)
+        need = max(1, math.ceil(len(wanted) * self.cutoff))
+        postings = sorted((self.grams.get(gram, ()) for gram in wanted), key=len)
+        fuzzy = []
+        sharing = [0] * (len(wanted) + 1)  # fuzzy matches by trigrams shared
+        for walked, ids in enumerate(postings[:len(wanted) - need + 1], 1):
+            for number in ids:
+                if number in seen:
+                    continue
+                seen.add(number)
+                entry = entries[number]
+                shared = len(wanted & entry[2])
+                if shared >= need:
+                    fuzzy.append((3, -shared, len(entry[1]), entry[1], entry[0]))
+                    sharing[shared] += 1
+            # every name sharing more than len(wanted) - walked trigrams has
+            # been seen, nothing unseen can outrank them
+            if limit is not None and len(found) + sum(sharing[len(wanted) - walked + 1:]) >= limit:
+                break
+        ranked = found + fuzzy
+        ranked = sorted(ranked) if limit is None else heapq.nsmallest(limit, ranked)
+        return [row[-1] for row in ranked]
+
+
+COMPACT_THRESHOLD = 1000  # ledger records before the snapshot is rewritten
+
+
+class DataStore:
+    """Catalog and inventory kept in memory, keyed by item name.
+
+    Files are read once and only reloaded when their mtime/size changes,
+    so every menu action gets O(1) name, price and quantity lookups.
+
+    Stock lives in two files: `inventory_file` is a consolidated
+    `name,qty` snapshot and `ledger_file` gets one `kind,name,delta` line
+    appended per sale, purchase or removal. Current stock is the snapshot
+    plus every delta. Once the ledger grows past `compact_threshold`
+    records a background thread folds it back into the snapshot.
+
+    Each item also has a FIFO queue of cost lots, `[quantity, unit cost]`
+    in purchase order. A purchase appends a lot and a sale eats lots from
+    the front, so the cost of goods sold is what the oldest stock cost.
+    The snapshot saves the lots after the quantity (`name,qty,5@2.5,3@3.0`),
+    so loading them never means replaying the purchase history. Old
+    `name,qty,unit price` rows become one lot at that price, and stock
+    without lots, from before lots were kept, is costed at 0.
+
+    Each compaction starts a new ledger generation: the ledger's first
+    line is `#<generation>` and the snapshot's is `#<generation>,<offset>`,
+    the ledger bytes it already holds. Compaction installs the snapshot
+    before it rewrites the ledger, so after a crash between the two the
+    snapshot names the generation still on disk and loading skips the
+    records it already counted. Files without these lines are from
+    generation 0.
+
+    `reorder_file` holds `name,level` lines, the last one per item wins
+    and an empty level clears it. Items whose quantity is at or below
+    their reorder level are kept in the `low` set, updated with every
+    stock change, so the low-stock list costs O(k) for k low items
+    instead of a walk over the whole inventory.
+
+    Several terminals may share the files. Writers hold an exclusive
+    fcntl lock on `<ledger_file>.lock` from the stock check to the append
+    (see `transaction()`), and reloads happen under a shared lock, so
+    nobody reads a half-done compaction.
+    """
+
+    def __init__(self, item_file, inventory_file, ledger_file, compact_threshold=COMPACT_THRESHOLD,
+                 reorder_file=None):
+        self.item_file = item_file
+        self.inventory_file = inventory_file
+        self.ledger_file = ledger_file
+        self.reorder_file = reorder_file
+        self.compact_threshold = compact_threshold
+        self.prices = {}       # item name -> selling price
+        self.lower_names = {}  # lowercased item name -> item name
+        self.stock = {}        # item name -> quantity in inventory
+        self.lots = {}         # item name -> deque of [quantity, unit cost], oldest first
+        self.reorder = {}      # item name -> reorder level
+        self.low = set()       # items with a reorder level and no more stock than it
+        self.version = 0       # bumped every time the catalog changes
+        self._item_sig = False  # False = never loaded
+        self._inv_sig = False
+        self._ledger_sig = False
+        self._reorder_sig = False
+        self._ledger_offset = 0  # bytes of the ledger already applied
+        self._ledger_records = 0
+        self._covered = (0, 0)  # (ledger generation, bytes) the snapshot holds
+        self._lock = FileLock(ledger_file + ".lock")
+        self._compactor = None
+        self._prefix_index = None
+        self._prefix_version = None
+        self._fuzzy_index = None
+        self._fuzzy_version = None
+
+    @property
+    def lock(self):
+        """The writers' FileLock, for files kept in step with the store"""
+        return self._lock
+
+    # ---------- loading ----------
+
+    def refresh(self):
+        """Reload any file that changed on disk since it was last read"""
+        if (file_signature(self.item_file) == self._item_sig
+                and file_signature(self.inventory_file) == self._inv_sig
+                and file_signature(self.ledger_file) == self._ledger_sig
+                and (self.reorder_file is None or file_signature(self.reorder_file) == self._reorder_sig)):
+            return
+        with metrics.phase("read"), self._lock.shared():
+            sig = file_signature(self.item_file)
+            if sig != self._item_sig:
+                self._load_items()
+                self._item_sig = sig
+            inv_sig = file_signature(self.inventory_file)
+            ledger_sig = file_signature(self.ledger_file)
+            if inv_sig != self._inv_sig:
+                self._load_stock()
+            elif ledger_sig != self._ledger_sig:
+                if ledger_sig is not None and ledger_sig[1] >= self._ledger_offset:
+                    self._replay_ledger()  # only appended to, apply the new tail
+                else:
+                    self._load_stock()
+            if self.reorder_file is not None:
+                reorder_sig = file_signature(self.reorder_file)
+                if reorder_sig != self._reorder_sig:
+                    self._load_reorder()
+                    self._reorder_sig = reorder_sig
+
+    def _load_items(self):
+        self.prices = {}
+        self.lower_names = {}
+        if os.path.exists(self.item_file):
+            with open(self.item_file, "r") as file:
+                for line in file:
+                    parts = line.strip().split(",")
+                    if len(parts) < 2 or not parts[0]:
+                        continue
+                    try:
+                        price = float(parts[1])
+                    except ValueError:
+                        continue
+                    self.prices[parts[0]] = price
+                    self.lower_names.setdefault(parts[0].lower(), parts[0])
+        self.version += 1
+
+    def _ledger_header(self):
+        """(generation, header length in bytes) of the ledger file"""
+        if os.path.exists(self.ledger_file):
+            with open(self.ledger_file, "rb") as file:
+                first = file.readline()
+            if first.startswith(b"#") and first.endswith(b"\n"):
+                try:
+                    return int(first[1:]), len(first)
+                except ValueError:
+                    pass
+        return 0, 0
+
+    def _load_stock(self):
+        self.stock = {}
+        self.lots = {}
+        self._covered = (0, 0)
+        if os.path.exists(self.inventory_file):
+            with open(self.inventory_file, "r") as file:
+                for line in file:
+                    if line.startswith("#"):
+                        try:
+                            generation, offset = line[1:].strip().split(",")
+                            self._covered = (int(generation), int(offset))
+                        except ValueError:
+                            pass
+                        continue
+                    parts = line.strip().split(",")
+                    if len(parts) < 2 or not parts[0]:
+                        continue
+                    try:
+                        qty = int(parts[1])
+                    except ValueError:
+                        continue
+                    lots = []
+                    for field in parts[2:]:
+                        try:
+                            if "@" in field:
+                                lot_qty, cost = field.split("@")
+                                lots.append([int(lot_qty), float(cost)])
+                            elif len(parts) == 3:
+                                lots.append([qty, float(field)])  # old name,qty,unit price row
+                        except ValueError:
+                            continue  # bad lot, the row's quantity still counts
+                    self.stock[parts[0]] = self.stock.get(parts[0], 0) + qty
+                    self.lots.setdefault(parts[0], deque()).extend(lots)
+        for name, qty in self.stock.items():
+            queue = self.lots.setdefault(name, deque())
+            uncosted = qty - sum(lot[0] for lot in queue)
+            if uncosted > 0:
+                queue.appendleft([uncosted, 0.0])
+        self._inv_sig = file_signature(self.inventory_file)
+        generation, header = self._ledger_header()
+        covered_generation, covered = self._covered
+        # The ledger is still the generation the snapshot was taken from when
+        # a compaction died before rewriting it; skip what the snapshot holds
+        self._ledger_offset = max(covered, header) if generation == covered_generation else header
+        self._ledger_records = 0
+        self._replay_ledger()
+        self.low = {name for name in self.reorder if self.stock.get(name, 0) <= self.reorder[name]}
+
+    def _load_reorder(self):
+        self.reorder = {}
+        if os.path.exists(self.reorder_file):
+            with open(self.reorder_file, "r") as file:
+                for line in file:
+                    parts = line.strip().split(",")
+                    if len(parts) < 2 or not parts[0]:
+                        continue
+                    if not parts[1]:
+                        self.reorder.pop(parts[0], None)
+                        continue
+                    try:
+                        self.reorder[parts[0]] = int(parts[1])
+                    except ValueError:
+                        continue
+        self.low = {name for name in self.reorder if self.stock.get(name, 0) <= self.reorder[name]}
+
+    def _check_low(self, name):
+        """Move one item in or out of the low-stock set after a change"""
+        level = self.reorder.get(name)
+        if level is not None and self.stock.get(name, 0) <= level:
+            self.low.add(name)
+        else:
+            self.low.discard(name)
+
+    def _replay_ledger(self):
+        """Apply ledger records written after `_ledger_offset`"""
+        if os.path.exists(self.ledger_file):
+            with open(self.ledger_file, "rb") as file:
+                file.seek(self._ledger_offset)
+                for raw in file:
+                    if not raw.endswith(b"\n"):
+                        break  # half-written record, pick it up next time
+                    self._ledger_offset += len(raw)
+                    self._ledger_records += 1
+                    self._apply(raw.decode().strip().split(","))
+        self._ledger_sig = file_signature(self.ledger_file)
+
+    def _apply(self, parts):
+        """Apply one ledger record; a sale returns the cost of what it took"""
+        if len(parts) < 3:
+            return None
+        kind, name = parts[0], parts[1]
+        if kind == "remove":
+            self.stock.pop(name, None)
+            self.lots.pop(name, None)
+            self._check_low(name)
+            return None
+        try:
+            delta = int(parts[2])
+        except ValueError:
+            return None
+        self.stock[name] = self.stock.get(name, 0) + delta
+        self._check_low(name)
+        if delta > 0:
+            try:
+                cost = float(parts[3]) if len(parts) > 3 else 0.0
+            except ValueError:
+                cost = 0.0
+            self.lots.setdefault(name, deque()).append([delta, cost])
+            return None
+        return self._consume(name, -delta)
+
+    def _consume(self, name, quantity):
+        """Take `quantity` from the oldest lots, returns their total cost"""
+        queue = self.lots.get(name)
+        cost = 0.0
+        while queue and quantity > 0:
+            lot = queue[0]
+            taken = min(lot[0], quantity)
+            cost += taken * lot[1]
+            quantity -= taken
+            lot[0] -= taken
+            if lot[0] == 0:
+                queue.popleft()
+        return cost
+
+    # ---------- lookups ----------
+
+    def items(self):
+        """All catalog item names, in file order"""
+        self.refresh()
+        return list(self.prices)
+
+    def catalog(self):
+        """Copy of the item name -> price mapping"""
+        self.refresh()
+        return dict(self.prices)
+
+    def price(self, name):
+        """Selling price of an item, or None if it is not in the catalog"""
+        self.refresh()
+        return self.prices.get(name)
+
+    def quantity(self, name):
+        """Quantity in inventory, or None if the item is not stocked"""
+        self.refresh()
+        return self.stock.get(name)
+
+    def find(self, name):
+        """Case-insensitive catalog lookup, returns the stored name or None"""
+        self.refresh()
+        return self.lower_names.get(name.strip().lower())
+
+    def prefix_index(self):
+        """PrefixIndex over the catalog, rebuilt only when the catalog changes"""
+        self.refresh()
+        if self._prefix_version != self.version:
+            self._prefix_index = PrefixIndex(self.prices)
+            self._prefix_version = self.version
+        return self._prefix_index
+
+    def fuzzy_index(self):
+        """TrigramIndex over the catalog. Built once, then items added
+        through this store are indexed in place; it is only rebuilt when
+        another terminal changes the catalog file."""
+        self.refresh()
+        if self._fuzzy_version != self.version:
+            self._fuzzy_index = TrigramIndex(self.prices)
+            self._fuzzy_version = self.version
+        return self._fuzzy_index
+
+    def inventory(self):
+        """(name, quantity) pairs currently in inventory"""
+        self.refresh()
+        return list(self.stock.items())
+
+    def reorder_level(self, name):
+        """Reorder level of an item, or None if it has none"""
+        self.refresh()
+        return self.reorder.get(name)
+
+    def low_stock(self):
+        """(name, quantity, reorder level) of the items at or below their
+        reorder level, furthest below first"""
+        self.refresh()
+        rows = [(name, self.stock.get(name, 0), self.reorder[name]) for name in self.low]
+        rows.sort(key=lambda row: (row[1] - row[2], row[0]))
+        return rows
+
+    def lots_of(self, name):
+        """(quantity, unit cost) lots of an item, oldest first"""
+        self.refresh()
+        return [tuple(lot) for lot in self.lots.get(name, ())]
+
+    def valuation(self):
+        """Item name -> cost of the stock on hand, from its lots"""
+        self.refresh()
+        return {name: sum(qty * cost for qty, cost in queue) for name, queue in self.lots.items() if queue}
+
+    # ---------- updates ----------
+
+    @contextmanager
+    def transaction(self):
+        """Hold the write lock, with everything reloaded, for a check-then-write"""
+        with self._lock:
+            self.refresh()
+            yield self
+
+    def add_item(self, name, price):
+        with self.transaction():
+            with open(self.item_file, "a") as file:
+                file.write(f"{name},{price}\n")
+            indexed = self._fuzzy_version == self.version and name not in self.prices
+            self.prices[name] = price
+            self.lower_names.setdefault(name.lower(), name)
+            self.version += 1
+            if indexed:
+                self._fuzzy_index.add(name)
+                self._fuzzy_version = self.version
+            self._item_sig = file_signature(self.item_file)
+
+    def set_reorder_level(self, name, level):
+        """Set the quantity at which an item is reported low; None clears it"""
+        with self.transaction():
+            with open(self.reorder_file, "a") as file:
+                file.write(f"{name},{'' if level is None else level}\n")
+            if level is None:
+                self.reorder.pop(name, None)
+            else:
+                self.reorder[name] = level
+            self._check_low(name)
+            self._reorder_sig = file_signature(self.reorder_file)
+
+    def add_stock(self, name, quantity, price):
+        """Record purchased stock"""
+        self.add_stock_many([(name, quantity, price)])
+
+    def add_stock_many(self, rows):
+        """Record several (name, quantity, price) purchases with one write"""
+        self._append([["purchase", name, str(qty), str(price)] for name, qty, price in rows])
+
+    def remove_stock(self, name, quantity):
+        """Take sold stock out of inventory, returns its FIFO cost"""
+        return self.remove_stock_many([(name, quantity)])[0]
+
+    def remove_stock_many(self, rows):
+        """Take several (name, quantity) sales out of inventory with one write.
+        Returns the FIFO cost of each row."""
+        return self._append([["sell", name, str(-qty)] for name, qty in rows])
+
+    def drop_item(self, name):
+        """Remove an item from inventory entirely. False if it was not stocked."""
+        with self.transaction():
+            if name not in self.stock:
+                return False
+            self._append([["remove", name, "0"]])
+            return True
+
+    def _append(self, records):
+        with self.transaction(), metrics.phase("write"):
+            data = "".join(",".join(parts) + "\n" for parts in records)
+            with open(self.ledger_file, "a") as file:
+                file.write(data)
+            results = [self._apply(parts) for parts in records]
+            self._ledger_offset += len(data.encode())
+            self._ledger_records += len(records)
+            self._ledger_sig = file_signature(self.ledger_file)
+            if self._ledger_records >= self.compact_threshold:
+                self.start_compaction()
+            return results
+
+    # ---------- compaction ----------
+
+    def start_compaction(self):
+        """Fold the ledger into the snapshot on a background thread"""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            # Not a daemon thread, so the interpreter waits for it on exit
+            self._compactor = threading.Thread(target=self.compact)
+            self._compactor.start()
+
+    def wait_for_compaction(self):
+        """Block until the background compaction, if one is running, is done"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def compact(self):
+        """Rewrite the snapshot from memory and drop the ledger records it covers"""
+        with self._lock.shared():
+            self.refresh()
+            stock = dict(self.stock)
+            lots = {name: [tuple(lot) for lot in queue] for name, queue in self.lots.items()}
+            offset = self._ledger_offset
+            inv_sig = self._inv_sig
+            generation, _ = self._ledger_header()
+
+        # The slow part, writing every item, runs without holding the lock
+        tmp_name = f"{self.inventory_file}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as file:
+            file.write(f"#{generation},{offset}\n")
+            file.writelines(
+                ",".join([name, str(qty)] + [f"{lot_qty}@{cost}" for lot_qty, cost in lots.get(name, ())]) + "\n"
+                for name, qty in stock.items()
+            )
+            file.flush()
+            os.fsync(file.fileno())
+
+        with self._lock:
+            if file_signature(self.inventory_file) != inv_sig:
+                os.remove(tmp_name)  # another terminal compacted first
+                return
+            tail = b""
+            if os.path.exists(self.ledger_file):
+                with open(self.ledger_file, "rb") as file:
+                    file.seek(offset)
+                    tail = file.read()  # records appended while we were writing
+            # Snapshot first: if we die before the ledger is rewritten, its
+            # header says how much of this generation it already holds
+            os.replace(tmp_name, self.inventory_file)
+            header = f"#{generation + 1}\n".encode()
+            atomic_write(self.ledger_file, header + tail, sync=True)
+            self._inv_sig = file_signature(self.inventory_file)
+            self._covered = (generation, offset)
+            # The tail starts with records this process had already applied,
+            # up to _ledger_offset; other terminals may have appended more
+            # after that, which still have to be replayed
+            self._ledger_offset += len(header) - offset
+            self._ledger_records = tail[:self._ledger_offset - len(header)].count(b"\n")
+            self._replay_ledger()
@@ -0,0 +1,110 @@
+import shutil
+import tempfile
+import time
+from datetime import date
+from multiprocessing import Process, Queue
+
+from storage import TextStorage
+
+ITEM = "stress-item"
+
+
+def _writer(directory, number, sales, syncs):
+    """One counter terminal: try `sales` single-unit sales, restocking every tenth"""
+    storage = TextStorage.in_directory(directory)
+    today = date.today()
+    for i in range(sales):
+        if i % 10 == 9:
+            storage.purchase(f"supplier{number}", ITEM, 1, 2.0, today)
+        storage.sell(f"customer{number}", ITEM, 1, 5.0, today)
+    syncs.put(storage.journal.syncs)
+
+
+def run(writers=4, sales=500, directory=None):
+    """Race `writers` processes selling one item from a shared scratch
+    directory and check nothing was lost or oversold.
+
+    Stock starts at half the attempted sales, so writers keep running into
+    an empty shelf. The defaults write more records than the ledger's
+    compaction threshold, so ledger compaction runs during the race too;
+    `compacted` says whether it did. Returns a dict with the counts and
+    the throughput.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="data-entry-stress-")
+    storage = TextStorage.in_directory(directory)
+    storage.add_item(ITEM, 5.0)
+    initial = writers * sales // 2
+    storage.purchase("opening", ITEM, initial, 2.0, date.today())
+
+    started = time.perf_counter()
+    syncs = Queue()
+    processes = [Process(target=_writer, args=(directory, n, sales, syncs)) for n in range(writers)]
+    for process in processes:
+        process.start()
+    fsyncs = sum(syncs.get() for _ in processes)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    storage = TextStorage.in_directory(directory)
+    sold = sum(1 for _ in storage.iter_sales())
+    restocked = sum(purchase.quantity for purchase in storage.iter_purchases()) - initial
+    left = storage.quantity(ITEM)
+    in_lots = sum(quantity for quantity, _ in storage.lots(ITEM))
+    with open(storage.store.ledger_file, "rb") as file:
+        ledger_records = file.read().count(b"\n")
+    purchases = 1 + writers * (sales // 10)
+    attempts = writers * (sales + sales // 10)  # sales plus restocking purchases
+    return {
+        "directory": directory,
+        "writers": writers,
+        "sold": sold,
+        "stock_left": left,
+        "consistent": left >= 0 and left == initial + restocked - sold and in_lots == left,
+        "compacted": ledger_records < purchases + sold,
+        "seconds": elapsed,
+        "writes_per_second": attempts / elapsed if elapsed else 0,
+        "fsyncs": fsyncs,  # fsync rounds, fewer than writes when they were batched
+    }
+
+
+def compaction_crash(directory=None):
+    """Make the ledger rewrite fail halfway through a compaction, as if the
+    process died between installing the snapshot and rewriting the ledger,
+    and check that reopening the stores counts every record once.
+
+    Returns True if stock and lots come back as they were, also after a
+    later compaction that does finish.
+    """
+    import store
+
+    scratch = directory is None
+    directory = directory or tempfile.mkdtemp(prefix="data-entry-crash-")
+    storage = TextStorage.in_directory(directory)
+    storage.add_item(ITEM, 5.0)
+    today = date.today()
+    storage.purchase("opening", ITEM, 100, 1.0, today)
+    storage.sell("customer", ITEM, 10, 5.0, today)
+    expected = (storage.quantity(ITEM), list(storage.lots(ITEM)))
+
+    def crash(path, data, sync=False):
+        raise OSError("simulated crash before the ledger was rewritten")
+
+    atomic_write, store.atomic_write = store.atomic_write, crash
+    try:
+        storage.store.compact()
+    except OSError:
+        pass
+    finally:
+        store.atomic_write = atomic_write
+
+    reopened = TextStorage.in_directory(directory)
+    survived = (reopened.quantity(ITEM), list(reopened.lots(ITEM))) == expected
+    reopened.store.compact()
+    again = TextStorage.in_directory(directory)
+    survived = survived and (again.quantity(ITEM), list(again.lots(ITEM))) == expected
+    if scratch:
+        for opened in (storage, reopened, again):
+            opened.rollup.flush()
+        shutil.rmtree(directory)
+    return survived